@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+'''
+Report how many files the built-in signatures classify without libmagic, and
+how the results compare to libmagic. Also compares the time libmagic takes in
+a single thread and in a thread pool.
+
+Usage: bench/magic.py [path ...]
+'''
+
+# Python imports
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+# Project imports
+from classified import magic
+from classified.signature import HEADER_SIZE, sniff
+
+
+def files(paths):
+    for path in paths:
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                filename = os.path.join(root, name)
+                if os.path.isfile(filename) and not os.path.islink(filename):
+                    yield filename
+
+
+def bench_pool(filenames, threads=magic.POOL_SIZE):
+    pool = magic.MagicPool(threads, mime=True)
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        start = time.time()
+        list(executor.map(pool.from_file, filenames))
+        delta = time.time() - start
+    pool.close()
+    return delta
+
+
+def route(mimetype):
+    # The probes are routed on the text/* glob
+    if mimetype.startswith('text/'):
+        return 'text/*'
+    return mimetype
+
+
+def main():
+    paths = sys.argv[1:] or ['testdata']
+
+    total = hits = 0
+    sniff_time = magic_time = 0.0
+    agree = collections.Counter()
+    differ = collections.Counter()
+    filenames = []
+    for filename in files(paths):
+        try:
+            start = time.time()
+            with open(filename, 'rb') as handle:
+                header = handle.read(HEADER_SIZE)
+            mimetype = sniff(header, complete=len(header) < HEADER_SIZE)
+            sniff_time += time.time() - start
+
+            start = time.time()
+            expect = magic.from_file(filename, mime=True).decode('ascii')
+            magic_time += time.time() - start
+        except (IOError, OSError):
+            continue
+
+        total += 1
+        filenames.append(filename)
+        if mimetype is None:
+            continue
+
+        hits += 1
+        if route(mimetype) == route(expect):
+            agree[mimetype] += 1
+        else:
+            differ[(mimetype, expect)] += 1
+
+    print('{} files, {} classified by signature ({:.1f}%)'.format(
+        total, hits, 100.0 * hits / max(total, 1)))
+    print('signatures {:.3f}s, libmagic {:.3f}s, libmagic in {} threads '
+          '{:.3f}s'.format(sniff_time, magic_time, magic.POOL_SIZE,
+                           bench_pool(filenames)))
+    for mimetype, count in agree.most_common():
+        print('  {:<40} {:>8}'.format(mimetype, count))
+    for (mimetype, expect), count in differ.most_common():
+        print('  {:<40} {:>8} (libmagic: {})'.format(mimetype, count, expect))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+'''
+Compare the throughput of the PAN probe against the per character engine it
+replaced, and check that both engines report the same findings. Both engines
+are run over log like text and over digit dense CSV data.
+'''
+
+# Python imports
+import logging
+import random
+import sys
+import time
+
+# Project imports
+from classified.config import Config
+from classified.probe.base import LineBuffer, isdigit
+from classified.probe.pan import PAN, generate, mask, luhn_sum_mod_base
+
+
+class Collect(object):
+    def record(self, item, **kwargs):
+        self.findings.append((
+            kwargs['line'],
+            kwargs['raw'],
+            kwargs['card_number'],
+            kwargs['company'],
+        ))
+
+
+class VectorPAN(Collect, PAN):
+    pass
+
+
+class LegacyPAN(Collect, PAN):
+    '''
+    The per character engine.
+    '''
+
+    def start(self, item):
+        self.digits = []
+        self.lines = LineBuffer()
+        self.line = 0
+        self.hits = 0
+        self.prev = 0
+        self.ignore_bytes = set(ord(char) for char in self.ignore)
+
+    def feed(self, item, chunk):
+        for text in self.lines.feed(chunk):
+            if self.probe_line(item, text) is False:
+                self.lines = None
+                return False
+
+    def finish(self, item):
+        if self.lines is not None:
+            for text in self.lines.flush():
+                self.probe_line(item, text)
+
+    def probe_line(self, item, text):
+        digits_min = self.digits_min
+        digits_max = self.digits_max
+
+        self.line += 1
+        for char in text:
+            if isdigit(char):
+                self.digits.append(char - 48)
+
+                if len(self.digits) > digits_max:
+                    self.digits = self.digits[1:]
+
+                if len(self.digits) >= digits_min:
+                    for x in range(digits_min, digits_max + 1):
+                        card_number = ''.join(map(str, self.digits[:x]))
+                        card_company = self.luhn_check(card_number)
+                        if card_company is not None:
+                            self.record(item,
+                                raw=text,
+                                line=self.line,
+                                card_number=card_number,
+                                card_number_masked=mask(card_number),
+                                company=card_company,
+                            )
+                            self.digits = self.digits[x:]
+                            self.hits += 1
+                            if self.limit and self.hits >= self.limit:
+                                return False
+                            break
+
+            elif char in self.ignore_bytes:
+                if self.prev in self.ignore_bytes:
+                    self.digits = []
+
+            else:
+                self.digits = []
+
+            self.prev = char
+
+
+def card(prefix, length):
+    number = prefix + ''.join(
+        random.choice('0123456789') for x in range(length - len(prefix) - 1))
+    return number + generate(number)
+
+
+def separate(number, separator):
+    return separator.join(number[x:x + 4] for x in range(0, len(number), 4))
+
+
+def corpus(size):
+    '''
+    Log like text with time stamps, addresses, long digit runs and some card
+    numbers, split over lines in various ways.
+    '''
+    lines = []
+    total = 0
+    while total < size:
+        kind = random.random()
+        if kind < 0.02:
+            line = 'payment %s accepted' % separate(
+                card(random.choice(['4', '51', '6011', '6304', '37']),
+                     random.choice([13, 15, 16, 19])),
+                random.choice(['', '-', ':', '--', ' ']))
+        elif kind < 0.03:
+            line = ''.join(random.choice('0123456789-:') for x in range(80))
+        elif kind < 0.04:
+            number = card('5', 16)
+            line = number[:7] + '\n' + number[7:]
+        else:
+            line = '2016-%02d-%02d %02d:%02d:%02d host%d sshd[%d]: ' \
+                'connection from 10.%d.%d.%d port %d' % (
+                    random.randint(1, 12), random.randint(1, 28),
+                    random.randint(0, 23), random.randint(0, 59),
+                    random.randint(0, 59), random.randint(0, 99),
+                    random.randint(100, 99999), random.randint(0, 255),
+                    random.randint(0, 255), random.randint(0, 255),
+                    random.randint(1024, 65535))
+        line += random.choice(['\n', '\n', '\r\n'])
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode('ascii')
+
+
+def corpus_csv(size):
+    '''
+    Digit dense CSV export, with an occasional card number.
+    '''
+    lines = []
+    total = 0
+    while total < size:
+        fields = [str(random.randint(0, 10 ** random.randint(1, 12)))
+                  for x in range(8)]
+        if random.random() < 0.01:
+            fields[3] = card('4', 16)
+        line = ','.join(fields) + '\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode('ascii')
+
+
+def bench_luhn(count):
+    numbers = [card('4', 16) for x in range(count)]
+    generic = lambda s: int(s, 10)
+    for name, decoder in (('generic', generic), ('table', None)):
+        kwargs = dict(decoder=decoder) if decoder else {}
+        start = time.time()
+        for number in numbers:
+            luhn_sum_mod_base(number, **kwargs)
+        delta = time.time() - start
+        print('luhn {:<8} {:>10.0f} checks/s'.format(name, count / delta))
+
+
+def run(probe, data, blocksize):
+    probe.findings = []
+    probe.start(None)
+    for offset in range(0, len(data), blocksize):
+        if probe.feed(None, data[offset:offset + blocksize]) is False:
+            break
+    probe.finish(None)
+    return probe.findings
+
+
+def main():
+    size = 4 << 20
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1]) << 20
+
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(42)
+    config = Config('')
+    legacy = LegacyPAN(config, None)
+    vector = VectorPAN(config, None)
+
+    bench_luhn(100000)
+
+    for kind, generator in (('log', corpus), ('csv', corpus_csv)):
+        data = generator(size)
+
+        # Small block sizes test the state kept between chunks
+        sample = data[:1 << 18]
+        expect = run(legacy, sample, 65536)
+        for blocksize in (1, 7, 64, 4096):
+            if run(vector, sample, blocksize) != expect:
+                print('findings differ with block size %d' % blocksize)
+                return 1
+
+        results = {}
+        for name, probe in (('legacy', legacy), ('vector', vector)):
+            start = time.time()
+            findings = run(probe, data, 65536)
+            delta = time.time() - start
+            results[name] = findings
+            print('{} {:<8} {:>6} findings in {:.3f}s ({:.2f} MB/s)'.format(
+                kind, name, len(findings), delta,
+                len(data) / delta / (1 << 20)))
+
+        if results['legacy'] != results['vector']:
+            print('findings differ')
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+'''
+Count the stat family system calls issued per file while walking a tree, and
+measure the memory used by the items of the walk.
+
+The walk touches the same file attributes the scanner, the probes, the
+reporting engine and the incremental cache use (``size``, ``mtime`` and
+``stat()``), so the numbers reflect a full pass over every file.
+'''
+
+# Python imports
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Project imports
+from classified.meta import Path
+
+
+COUNTS = collections.Counter()
+
+
+def counted(name, function):
+    def wrapper(*args, **kwargs):
+        COUNTS[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+class CountedEntry(object):
+    '''
+    Proxy for :class:`os.DirEntry` that counts the first (uncached) call to
+    ``stat()``.
+    '''
+
+    def __init__(self, entry):
+        self._entry = entry
+        self._stat = {}
+
+    def __getattr__(self, attr):
+        return getattr(self._entry, attr)
+
+    def __fspath__(self):
+        return self._entry.path
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks not in self._stat:
+            COUNTS['DirEntry.stat'] += 1
+            self._stat[follow_symlinks] = self._entry.stat(
+                follow_symlinks=follow_symlinks)
+        return self._stat[follow_symlinks]
+
+
+class CountedScandir(object):
+    def __init__(self, path):
+        COUNTS['scandir'] += 1
+        self._iterator = SCANDIR(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return CountedEntry(next(self._iterator))
+
+    def close(self):
+        self._iterator.close()
+
+
+ORIGINAL = {}
+SCANDIR = getattr(os, 'scandir', None)
+
+
+def install():
+    for name in ('access', 'listdir', 'lstat', 'stat'):
+        ORIGINAL[name] = getattr(os, name)
+        setattr(os, name, counted(name, ORIGINAL[name]))
+    if SCANDIR is not None:
+        os.scandir = CountedScandir
+
+
+def uninstall():
+    for name, function in ORIGINAL.items():
+        setattr(os, name, function)
+    if SCANDIR is not None:
+        os.scandir = SCANDIR
+
+
+def populate(root, dirs, files):
+    for d in range(dirs):
+        path = os.path.join(root, 'dir%04d' % d)
+        os.mkdir(path)
+        for f in range(files):
+            with open(os.path.join(path, 'file%04d.txt' % f), 'w') as handle:
+                handle.write('hello world\n')
+
+
+def run(root):
+    total = 0
+    for item in Path(root).walk(recurse=True, deflate=False):
+        if not item.readable:
+            continue
+        total += 1
+        # Scanner.test_exclude_* and File.maybe
+        item.size
+        # Incremental (mtime)
+        item.mtime
+        # Probe.record
+        item.stat()
+    return total
+
+
+def memory(root):
+    '''
+    Bytes allocated per item, keeping all the items of the walk.
+    '''
+    tracemalloc.start()
+    items = list(Path(root).walk(recurse=True, deflate=False))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(items), size
+
+
+def main():
+    dirs, files = 50, 200
+    if len(sys.argv) > 1:
+        dirs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        files = int(sys.argv[2])
+
+    root = tempfile.mkdtemp(prefix='classified-bench-')
+    try:
+        populate(root, dirs, files)
+        install()
+        start = time.time()
+        total = run(root)
+        delta = time.time() - start
+        counts = dict(COUNTS)
+        uninstall()
+        items, size = memory(root)
+    finally:
+        uninstall()
+        shutil.rmtree(root)
+
+    calls = sum(counts.values())
+    print('walked {} files in {} directories in {:.3f}s'.format(
+        total, dirs, delta))
+    for name, count in sorted(counts.items()):
+        print('  {:<16} {:>8} ({:.2f} per file)'.format(
+            name, count, float(count) / max(total, 1)))
+    print('  {:<16} {:>8} ({:.2f} per file)'.format(
+        'total', calls, float(calls) / max(total, 1)))
+    print('{} items use {} bytes ({:.0f} per item)'.format(
+        items, size, float(size) / max(items, 1)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,7 +10,7 @@ class Adler32(object):
     digest_size = 4
     name = 'adler32'
 
-    def __init__(self, string=''):
+    def __init__(self, string=b''):
         self.checksum = adler32(string)
 
     def update(self, string):
@@ -29,7 +29,7 @@ class CRC32(object):
     digest_size = 4
     name = 'crc32'
 
-    def __init__(self, string=''):
+    def __init__(self, string=b''):
         self.checksum = crc32(string)
 
     def update(self, string):
@@ -42,7 +42,32 @@ class CRC32(object):
         return '%08x' % (self.checksum & 0xffffffff,)
 
 
-def new(algorithm, string=''):
+class Tee(object):
+    '''
+    Updates multiple checksums with the same data.
+    '''
+
+    def __init__(self, *hashes):
+        self.hashes = hashes
+
+    def update(self, string):
+        for hashing in self.hashes:
+            hashing.update(string)
+
+
+def tee(*hashes):
+    '''
+    Combine the checksums that are not None, returns None if there are none.
+    '''
+    hashes = [hashing for hashing in hashes if hashing is not None]
+    if not hashes:
+        return None
+    elif len(hashes) == 1:
+        return hashes[0]
+    return Tee(*hashes)
+
+
+def new(algorithm, string=b''):
     if algorithm == 'adler32':
         return Adler32(string)
 
@@ -0,0 +1,131 @@
+# Python imports
+import collections
+import logging
+import stat
+
+# Project imports
+from classified import checksum
+from classified.meta import ArchiveFile
+
+
+# Findings of a file, and the contents they were found in
+Entry = collections.namedtuple('Entry', 'digest path names findings')
+
+
+class Dedupe(object):
+    '''
+    Findings of the files scanned in this run, by their contents. Files are
+    matched on their size, permissions and owner and a checksum of their first
+    and last block, and candidates are confirmed with a checksum of the whole
+    file. If there are more entries than the configured size, the least
+    recently used entries are evicted.
+    '''
+
+    default_size = 65536
+    # Size of the first and last block in the key
+    block_size = 4096
+    algorithm = 'sha1'
+
+    def __init__(self, config):
+        self.config = config
+        try:
+            self.size = self.config.getint('scanner', 'dedupe_size')
+        except self.config.Error:
+            self.size = self.default_size
+
+        self.entries = collections.OrderedDict()
+        self.stats = collections.Counter()
+
+    def log_stats(self):
+        if self.stats:
+            logging.info('dedupe: %d hits, %d misses, %d collisions, %d key '
+                         'reads, %d full reads' % (
+                self.stats['hit'], self.stats['miss'],
+                self.stats['collision'], self.stats['read'],
+                self.stats['full_read']))
+
+    def new(self):
+        return checksum.new(self.algorithm)
+
+    def key(self, item):
+        '''
+        Key of the item contents, and a flag telling if the key covers the
+        whole file, so the checksum in the key is the checksum of the file.
+        Findings may depend on the permissions and the owner of the file, such
+        as keys that are readable by others, so these are part of the key.
+        '''
+        info = item.stat()
+        size = item.size
+        hashing = self.new()
+        self.stats['read'] += 1
+        with open(item.path, 'rb') as handle:
+            hashing.update(handle.read(self.block_size))
+            if size > 2 * self.block_size:
+                handle.seek(size - self.block_size)
+                hashing.update(handle.read(self.block_size))
+                complete = False
+            else:
+                hashing.update(handle.read())
+                complete = True
+
+        return (size, stat.S_IMODE(info.st_mode), info.st_uid, info.st_gid,
+                hashing.digest()), complete
+
+    def checksum(self, item):
+        hashing = self.new()
+        self.stats['full_read'] += 1
+        with open(item.path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(65536), b''):
+                hashing.update(chunk)
+        return hashing.digest()
+
+    def lookup(self, item):
+        '''
+        Returns the key of the item, the checksum of its contents if it was
+        calculated, and the entry of an earlier file with the same contents,
+        if any. The key is None if the item can not be deduplicated.
+        '''
+        # Archive members are read through their archive
+        if isinstance(item, ArchiveFile):
+            return None, None, None
+
+        try:
+            key, complete = self.key(item)
+        except (IOError, OSError):
+            return None, None, None
+
+        digest = key[-1] if complete else None
+        candidates = self.entries.get(key)
+        if candidates is None:
+            self.stats['miss'] += 1
+            return key, digest, None
+
+        self.entries.move_to_end(key)
+        if digest is None:
+            try:
+                digest = self.checksum(item)
+            except (IOError, OSError):
+                return None, None, None
+
+        for entry in candidates:
+            if entry.digest == digest:
+                self.stats['hit'] += 1
+                return key, digest, entry
+
+        self.stats['collision'] += 1
+        return key, digest, None
+
+    def add(self, key, digest, item, names, findings):
+        '''
+        Keep the findings in the item of the named probes, the probes that
+        ran on the item.
+        '''
+        entry = Entry(digest, item.path, frozenset(names), findings)
+        self.entries[key] = [
+            candidate
+            for candidate in self.entries.get(key, [])
+            if candidate.digest != digest
+        ] + [entry]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
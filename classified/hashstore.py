@@ -0,0 +1,204 @@
+'''
+Binary store of ignored hashes, for ignore lists that are too large for the
+configuration file. The store is a sorted array of digests, with an index on
+the first two bytes of the digest and a Bloom filter in front. It is mapped in
+memory, so opening a store is instant and the pages are shared by all
+processes reading the same store.
+
+Build a store from files with one hex digest per line::
+
+    python -m classified.hashstore ignore.db hashes.txt [...]
+'''
+
+# Python imports
+import binascii
+import hashlib
+import mmap
+import optparse
+import os
+import struct
+import sys
+
+
+MAGIC = b'CLHS'
+VERSION = 1
+
+# Magic, version, digest size, number of digests, Bloom filter size in bits
+# and number of Bloom filter hashes
+HEADER = struct.Struct('<4sHHQQI')
+# Index of the digests by their first two bytes, as the offset of the first
+# digest in each bucket
+BUCKETS = 1 << 16
+OFFSET = struct.Struct('<Q')
+BUCKET = struct.Struct('<2Q')
+
+# Bloom filter bits per digest and hashes, about 1% false positives
+BLOOM_BITS = 10
+BLOOM_HASHES = 7
+
+# Stores shared by all probes, by file name
+STORES = {}
+
+
+def get_hashstore(filename):
+    filename = os.path.abspath(filename)
+    if filename not in STORES:
+        STORES[filename] = HashStore(filename)
+    return STORES[filename]
+
+
+def bloom_positions(digest, bits, hashes):
+    # Double hashing, digests of short checksums such as crc32 are spread
+    # over 128 bits first
+    if len(digest) < 16:
+        digest = hashlib.blake2b(digest, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:16], 'little') | 1
+    mask = bits - 1
+    return [(h1 + i * h2) & mask for i in range(hashes)]
+
+
+class HashStore(object):
+    '''
+    Read only store of digests.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'ignore.db')
+    >>> build(filename, [hashlib.sha1(b'%d' % x).digest() for x in range(9)])
+    9
+    >>> store = HashStore(filename)
+    >>> len(store), hashlib.sha1(b'3').digest() in store
+    (9, True)
+    >>> hashlib.sha1(b'10').digest() in store
+    False
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as handle:
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            # Changes if the store is built again
+            info = os.fstat(handle.fileno())
+            self.identity = '%d %d %d' % (info.st_ino, info.st_size,
+                                          info.st_mtime_ns)
+
+        try:
+            magic, version, self.digest_size, self.count, self.bloom_bits, \
+                self.bloom_hashes = HEADER.unpack_from(self.map)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a hash store' % (filename,))
+
+        self.bloom = HEADER.size
+        self.buckets = self.bloom + self.bloom_bits // 8
+        self.digests = self.buckets + (BUCKETS + 1) * OFFSET.size
+        if len(self.map) != self.digests + self.count * self.digest_size:
+            raise ValueError('%s: hash store is truncated' % (filename,))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, digest):
+        if len(digest) != self.digest_size:
+            return False
+
+        # Most digests are not in the store, and are rejected by the filter
+        for position in bloom_positions(digest, self.bloom_bits,
+                                        self.bloom_hashes):
+            if not self.map[self.bloom + (position >> 3)] & \
+                    (1 << (position & 7)):
+                return False
+
+        bucket = int.from_bytes(digest[:2], 'big')
+        low, high = BUCKET.unpack_from(self.map,
+                                       self.buckets + bucket * OFFSET.size)
+        size = self.digest_size
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.digests + middle * size
+            value = self.map[offset:offset + size]
+            if value == digest:
+                return True
+            elif value < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+    def close(self):
+        self.map.close()
+
+
+def build(filename, digests):
+    '''
+    Write a store with the binary digests, returns the number of digests.
+    '''
+    digests = sorted(set(digests))
+    sizes = set(len(digest) for digest in digests)
+    if len(sizes) > 1:
+        raise ValueError('digests of different sizes: %s' % (
+            ', '.join(map(str, sorted(sizes))),))
+    digest_size = sizes.pop() if sizes else 20
+
+    bloom_bits = 64
+    while bloom_bits < len(digests) * BLOOM_BITS:
+        bloom_bits <<= 1
+    bloom = bytearray(bloom_bits // 8)
+    for digest in digests:
+        for position in bloom_positions(digest, bloom_bits, BLOOM_HASHES):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    # Start offset of each bucket, the last offset is the end of the array
+    buckets = [0] * (BUCKETS + 1)
+    for digest in digests:
+        buckets[int.from_bytes(digest[:2], 'big') + 1] += 1
+    for bucket in range(BUCKETS):
+        buckets[bucket + 1] += buckets[bucket]
+
+    # Replace the store at once, workers may still be reading the old one
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, VERSION, digest_size, len(digests),
+                                 bloom_bits, BLOOM_HASHES))
+        handle.write(bloom)
+        handle.write(struct.pack('<%dQ' % (BUCKETS + 1,), *buckets))
+        for digest in digests:
+            handle.write(digest)
+    os.replace(temp, filename)
+    return len(digests)
+
+
+def read_digests(handle):
+    for line in handle:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            yield binascii.unhexlify(line)
+
+
+def run():
+    parser = optparse.OptionParser(
+        usage='%prog <store> [<file> ...]',
+        description='Build a hash store from files with one hex digest per '
+                    'line, or from standard input.',
+    )
+    option, args = parser.parse_args()
+    if not args:
+        return parser.error('missing store')
+
+    digests = []
+    try:
+        if len(args) == 1:
+            digests.extend(read_digests(sys.stdin))
+        for filename in args[1:]:
+            with open(filename, 'r') as handle:
+                digests.extend(read_digests(handle))
+        count = build(args[0], digests)
+    except (binascii.Error, ValueError) as error:
+        return parser.error(str(error))
+
+    print('%s: %d digests' % (args[0], count))
+
+
+if __name__ == '__main__':
+    sys.exit(run())
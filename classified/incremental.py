@@ -1,24 +1,110 @@
 # Python imports
 try:
-    import dbm.ndbm
+    import dbm.ndbm as ndbm
 except ImportError:
-    import dbm as dbm
+    import dbm as ndbm
+import collections
+import json
 import logging
+import os
+import sqlite3
+import time
 
 # Project imports
 from classified import checksum
 
 
+def get_incremental(config):
+    return get_incremental_backend(config)(config)
+
+
+def get_incremental_backend(config):
+    backend = config.getdefault('incremental', 'backend', 'dbm')
+    try:
+        return BACKENDS[backend]
+    except KeyError:
+        raise TypeError('Invalid incremental backend %s, check the '
+                        'configuration' % backend)
+
+
+def dumps(value):
+    '''
+    Serialize findings to JSON, the kwargs of findings may contain bytes.
+
+    >>> dumps({'raw': b'4111\\n', 'line': 1})
+    '{"raw": {"__bytes__": "4111\\\\n"}, "line": 1}'
+    '''
+    return json.dumps(value, default=_dump_bytes)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_load_bytes)
+
+
+def _dump_bytes(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': value.decode('latin-1')}
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def _load_bytes(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return value['__bytes__'].encode('latin-1')
+    return value
+
+
+def below(path, root):
+    '''
+    Test if ``path`` is ``root`` or is below ``root``.
+
+    >>> below('/var/log/syslog', '/var/log')
+    True
+    >>> below('/var/logs', '/var/log')
+    False
+    '''
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def missing(path):
+    '''
+    Test if the file at ``path`` no longer exists. Files in an archive exist
+    as long as the archive exists.
+    '''
+    if os.path.lexists(path):
+        return False
+
+    parent = os.path.dirname(path)
+    while parent != path and not os.path.lexists(parent):
+        path, parent = parent, os.path.dirname(parent)
+    return not os.path.isfile(parent)
+
+
 class Incremental(object):
+    '''
+    Incremental store in a dbm database, a file is either scanned by all
+    probes or not at all. The findings and the fingerprints of the probes are
+    stored along with the checksum, so the findings can be reported again
+    while the file and the probe settings do not change.
+    '''
+
     default_algorithm = 'sha1'
     default_blocksize = 16384
+    # Can the store be updated by multiple processes at once?
+    shared = False
+    # Suffixes of the files of the database
+    suffixes = ('', '.db', '.dir', '.pag', '.dat', '.bak')
 
     def __init__(self, config):
         self.config = config
 
-        # Local cache
+        # Checksums calculated in this run, that have not been stored yet
         self.cache = {}
 
+        # Files seen in this run, and the hit, miss and stale counts
+        self.started = time.time()
+        self.seen = set()
+        self.stats = collections.Counter()
+
         # Configuration bits
         self.algorithm = self.config.getdefault('incremental', 'algorithm',
             self.default_algorithm)
@@ -27,23 +113,256 @@ class Incremental(object):
             self.blocksize = self.config.getint('incremental', 'blocksize')
         except self.config.NoOptionError:
             self.blocksize = self.default_blocksize
+        try:
+            self.stat = self.config.getboolean('incremental', 'stat')
+        except self.config.NoOptionError:
+            self.stat = True
+        try:
+            self.auto_prune = self.config.getboolean('incremental', 'prune')
+        except self.config.NoOptionError:
+            self.auto_prune = False
 
-        # Open the database in secure mode
-        self.db = dbm.ndbm.open(self.database, 'c', 0o600)
+        self.open()
 
         logging.info('only checking incremental changes')
         logging.debug('tracking incremental changes in %s' % self.database)
 
+    def open(self):
+        # Open the database in secure mode
+        self.db = ndbm.open(self.database, 'c', 0o600)
+
+    def close(self):
+        self.log_stats()
+        self.db.close()
+
+    def log_stats(self):
+        if self.stats:
+            logging.info('incremental cache: %d hits, %d misses, %d stale' % (
+                self.stats['hit'], self.stats['miss'], self.stats['stale']))
+
     def __contains__(self, item):
-        if str(item) in self.db:
-            old_value = self.db[str(item)]
-            new_value = self.cache.get(item, self.checksum(item))
-            return old_value == new_value
-        else:
+        return self.unchanged(item) is True
+
+    def unchanged(self, item):
+        '''
+        Returns True if the contents did not change since the item was
+        stored, False if they did and None if the item is not stored.
+        '''
+        key = str(item)
+        self.seen.add(key)
+        if key not in self.db:
+            self.stats['miss'] += 1
+            return None
+
+        old_identity, old_checksum, fingerprints, findings = self.parse(
+            self.db[key])
+        identity = self.identity(item)
+        if identity is not None:
+            if identity == old_identity:
+                return True
+
+            # The checksum is calculated while the item is scanned again
+            if item.changed(old_identity):
+                self.stats['stale'] += 1
+                return False
+
+        new_checksum = self.checksum(item)
+        if new_checksum != old_checksum:
+            # Keep it for add()
+            self.cache[key] = new_checksum
+            self.stats['stale'] += 1
             return False
 
-    def add(self, item):
-        self.db[str(item)] = self.cache.get(item, self.checksum(item))
+        # Contents did not change, so the next run can skip hashing
+        if identity is not None:
+            self.db[key] = self.format(identity, new_checksum, fingerprints,
+                                       findings)
+        return True
+
+    def stale(self, item, fingerprints):
+        '''
+        Returns the names of the probes that have to scan the item, given the
+        fingerprints of the probes by name.
+        '''
+        if not self.unchanged(item):
+            return list(fingerprints)
+        return self.stale_probes(item, fingerprints)
+
+    def stale_probes(self, item, fingerprints):
+        '''
+        Returns the names of the probes that have to scan an unchanged item,
+        because their settings changed since it was stored.
+        '''
+        # Entries of older versions have no fingerprints
+        stored = self.parse(self.db[str(item)])[2]
+        if stored != fingerprints:
+            self.stats['stale'] += 1
+            return list(fingerprints)
+
+        self.stats['hit'] += 1
+        return []
+
+    def findings(self, item, names=None):
+        '''
+        Returns the stored findings of the named probes (or all probes), as
+        (probe name, record kwargs) pairs.
+        '''
+        try:
+            findings = self.parse(self.db[str(item)])[3]
+        except KeyError:
+            return []
+
+        if not findings:
+            return []
+        return [
+            (name, kwargs)
+            for name, kwargs in loads(findings)
+            if names is None or name in names
+        ]
+
+    def digest(self, item):
+        '''
+        Returns a hashing object to calculate the checksum while the item is
+        scanned, or None if the checksum is not needed.
+        '''
+        if self.algorithm == 'mtime' or str(item) in self.cache:
+            return None
+        return checksum.new(self.algorithm)
+
+    def add(self, item, fingerprints=None, findings=None, checksum=None):
+        '''
+        Store the item, the ``checksum`` may be calculated while the item was
+        scanned.
+        '''
+        key = str(item)
+        checksum = self.cache.pop(key, None) or checksum
+        if checksum is None:
+            checksum = self.checksum(item)
+        if findings:
+            findings = dumps(findings)
+        self.db[key] = self.format(self.identity(item), checksum, fingerprints,
+                                   findings)
+
+    def keys(self):
+        return [key.decode('utf-8') for key in self.db.keys()]
+
+    def remove(self, keys):
+        for key in keys:
+            del self.db[key]
+
+    def prune(self, root):
+        '''
+        Remove the entries of files below ``root`` that were not seen in this
+        run, returns the number of removed entries.
+        '''
+        keys = [
+            key for key in self.keys()
+            if below(key, root) and not self.was_seen(key, self.seen)
+        ]
+        self.remove(keys)
+        logging.info('pruned %d entries below %s from the incremental '
+                     'cache' % (len(keys), root))
+        return len(keys)
+
+    def was_seen(self, key, seen):
+        # Files in archives are seen if the archive was seen
+        while key not in seen:
+            parent = os.path.dirname(key)
+            if parent == key:
+                return False
+            key = parent
+        return True
+
+    def prune_missing(self, roots=None):
+        '''
+        Remove the entries of files (below one of the ``roots``) that no
+        longer exist, returns the number of removed entries.
+        '''
+        keys = [
+            key for key in self.keys()
+            if (not roots or any(below(key, root) for root in roots))
+            and missing(key)
+        ]
+        self.remove(keys)
+        return len(keys)
+
+    def compact(self):
+        '''
+        Return the space of removed entries to the file system.
+        '''
+        reorganize = getattr(self.db, 'reorganize', None)
+        if reorganize is not None:
+            reorganize()
+            return
+
+        # Other dbm modules never shrink their files, so the entries are
+        # copied to a new database that replaces the old one
+        temp = self.database + '.compact'
+        db = ndbm.open(temp, 'n', 0o600)
+        try:
+            for key in self.db.keys():
+                db[key] = self.db[key]
+        finally:
+            db.close()
+
+        self.db.close()
+        for filename in self.files(temp):
+            os.replace(filename, self.database + filename[len(temp):])
+        self.open()
+
+    def files(self, database=None):
+        '''
+        Files of the database, the dbm modules add their own suffixes.
+        '''
+        database = database or self.database
+        return [
+            database + suffix
+            for suffix in self.suffixes
+            if os.path.isfile(database + suffix)
+        ]
+
+    def size(self):
+        return sum(
+            os.path.getsize(filename)
+            for filename in self.files()
+        )
+
+    def format(self, identity, checksum, fingerprints=None, findings=None):
+        if identity is not None:
+            checksum = '%s %s' % (identity, checksum)
+        value = '%s\n%s' % (checksum, dumps(fingerprints or {}))
+        if findings:
+            return '%s\n%s' % (value, findings)
+        return value
+
+    def parse(self, value):
+        '''
+        Returns the identity, checksum, probe fingerprints and serialized
+        findings stored in the database.
+
+        >>> Incremental.parse(None, b'1 2 3 4 ab\\n{"pan": "cd"}\\n[]')
+        ('1 2 3 4', 'ab', {'pan': 'cd'}, '[]')
+        '''
+        value, _, findings = value.decode('utf-8').partition('\n')
+        identity, _, checksum = value.rpartition(' ')
+
+        # Entries of older versions have no fingerprints
+        fingerprints = None
+        if findings.startswith('{'):
+            fingerprints, _, findings = findings.partition('\n')
+            fingerprints = loads(fingerprints)
+
+        return identity or None, checksum, fingerprints, findings or None
+
+    def identity(self, item):
+        '''
+        File metadata that changes if the file is modified, or None if the
+        metadata can not be trusted. Files in archives are identified by the
+        metadata of the archive.
+        '''
+        if not self.stat:
+            return None
+        return item.identity()
 
     def checksum(self, item):
         if self.algorithm == 'mtime':
@@ -51,14 +370,248 @@ class Incremental(object):
 
         else:
             method = checksum.new(self.algorithm)
-            handle = item.open()
-            while True:
-                chunk = handle.read(self.blocksize)
-                if not chunk:
-                    break
+            handle = item.open('rb')
+            try:
+                while True:
+                    chunk = handle.read(self.blocksize)
+                    if not chunk:
+                        break
+                    else:
+                        method.update(chunk)
+            finally:
+                handle.close()
+
+            return method.hexdigest()
+
+
+class SQLiteIncremental(Incremental):
+    '''
+    Incremental store in a SQLite database, that records the fingerprint of
+    the probes that scanned each file. If the settings of a probe change, only
+    that probe scans the file again. Changes are written in batches, and the
+    database may be shared by multiple processes.
+    '''
+
+    shared = True
+    suffixes = ('', '-wal', '-shm')
+    # Number of changes kept in memory before they are written
+    batch_size = 1024
+
+    def open(self):
+        # Create the database in secure mode
+        if not os.path.exists(self.database):
+            os.close(os.open(self.database, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        self.added = []
+        self.touched = []
+
+        self.db = sqlite3.connect(self.database, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS file (
+                    path        TEXT NOT NULL PRIMARY KEY,
+                    identity    TEXT,
+                    checksum    TEXT NOT NULL,
+                    seen        REAL NOT NULL
+                )
+            ''')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS probe (
+                    path        TEXT NOT NULL,
+                    probe       TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (path, probe)
+                )
+            ''')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS finding (
+                    path        TEXT NOT NULL,
+                    probe       TEXT NOT NULL,
+                    kwargs      TEXT NOT NULL
+                )
+            ''')
+            self.db.execute('''
+                CREATE INDEX IF NOT EXISTS finding_path ON finding (path, probe)
+            ''')
+
+    def close(self):
+        self.flush()
+        self.log_stats()
+        self.db.close()
+
+    def unchanged(self, item):
+        '''
+        Returns True if the contents did not change since the item was
+        stored, False if they did and None if the item is not stored.
+        '''
+        key = str(item)
+        row = self.db.execute('''
+            SELECT identity, checksum FROM file WHERE path = ?
+        ''', (key,)).fetchone()
+        if row is None:
+            self.stats['miss'] += 1
+            return None
+
+        old_identity, old_checksum = row
+        identity = self.identity(item)
+        if identity is not None:
+            if identity == old_identity:
+                self.touch(key)
+                return True
+
+            # The checksum is calculated while the item is scanned again
+            if item.changed(old_identity):
+                self.touch(key)
+                self.stats['stale'] += 1
+                return False
+
+        new_checksum = self.checksum(item)
+        if new_checksum != old_checksum:
+            # Keep it for add()
+            self.cache[key] = new_checksum
+            self.touch(key)
+            self.stats['stale'] += 1
+            return False
+
+        # Contents did not change, so the next run can skip hashing
+        self.touch(key, identity)
+        return True
+
+    def touch(self, key, identity=None):
+        '''
+        Mark the entry as seen in this run, and update its identity.
+        '''
+        self.touched.append((identity, self.started, key))
+        self.flush_maybe()
+
+    def stale_probes(self, item, fingerprints):
+        stored = dict(self.db.execute('''
+            SELECT probe, fingerprint FROM probe WHERE path = ?
+        ''', (str(item),)).fetchall())
+        names = [
+            name
+            for name, fingerprint in fingerprints.items()
+            if stored.get(name) != fingerprint
+        ]
+        self.stats['stale' if names else 'hit'] += 1
+        return names
+
+    def findings(self, item, names=None):
+        return [
+            (name, loads(kwargs))
+            for name, kwargs in self.db.execute('''
+                SELECT probe, kwargs FROM finding WHERE path = ?
+                ORDER BY rowid
+            ''', (str(item),))
+            if names is None or name in names
+        ]
+
+    def add(self, item, fingerprints=None, findings=None, checksum=None):
+        key = str(item)
+        checksum = self.cache.pop(key, None) or checksum
+        if checksum is None:
+            checksum = self.checksum(item)
+        self.added.append((key, self.identity(item), checksum,
+                           fingerprints or {}, findings or []))
+        self.flush_maybe()
+
+    def flush_maybe(self):
+        if len(self.added) + len(self.touched) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.added and not self.touched:
+            return
+
+        added, self.added = self.added, []
+        touched, self.touched = self.touched, []
+        with self.db:
+            for key, identity, checksum, fingerprints, findings in added:
+                row = self.db.execute('''
+                    SELECT checksum FROM file WHERE path = ?
+                ''', (key,)).fetchone()
+                if row is None or row[0] != checksum:
+                    # New contents, the results of all probes are void
+                    self.db.execute('''
+                        DELETE FROM probe WHERE path = ?
+                    ''', (key,))
+                    self.db.execute('''
+                        DELETE FROM finding WHERE path = ?
+                    ''', (key,))
+                    self.db.execute('''
+                        INSERT OR REPLACE INTO file
+                        (path, identity, checksum, seen)
+                        VALUES (?, ?, ?, ?)
+                    ''', (key, identity, checksum, self.started))
                 else:
-                    method.update(chunk)
-            handle.close()
+                    self.db.execute('''
+                        UPDATE file SET identity = ?, seen = ? WHERE path = ?
+                    ''', (identity, self.started, key))
+
+                self.db.executemany('''
+                    INSERT OR REPLACE INTO probe (path, probe, fingerprint)
+                    VALUES (?, ?, ?)
+                ''', [(key, name, fingerprint)
+                      for name, fingerprint in fingerprints.items()])
+                self.db.executemany('''
+                    DELETE FROM finding WHERE path = ? AND probe = ?
+                ''', [(key, name) for name in fingerprints])
+                self.db.executemany('''
+                    INSERT INTO finding (path, probe, kwargs) VALUES (?, ?, ?)
+                ''', [(key, name, dumps(kwargs))
+                      for name, kwargs in findings])
+
+            self.db.executemany('''
+                UPDATE file SET identity = COALESCE(?, identity), seen = ?
+                WHERE path = ?
+            ''', touched)
+
+        logging.debug('stored %d incremental changes in %s' % (
+            len(added) + len(touched), self.database))
+
+    def keys(self):
+        return [
+            row[0]
+            for row in self.db.execute('SELECT path FROM file')
+        ]
+
+    def remove(self, keys):
+        with self.db:
+            for table in ('file', 'probe', 'finding'):
+                self.db.executemany('''
+                    DELETE FROM %s WHERE path = ?
+                ''' % (table,), [(key,) for key in keys])
+
+    def prune(self, root):
+        # Entries seen by other processes are marked in the database
+        self.flush()
+        seen = set(
+            key
+            for key, in self.db.execute('''
+                SELECT path FROM file WHERE seen >= ?
+            ''', (self.started,))
+        )
+        keys = [
+            key
+            for key, in self.db.execute('''
+                SELECT path FROM file WHERE seen < ?
+            ''', (self.started,))
+            if below(key, root) and not self.was_seen(key, seen)
+        ]
+        self.remove(keys)
+        logging.info('pruned %d entries below %s from the incremental '
+                     'cache' % (len(keys), root))
+        return len(keys)
+
+    def compact(self):
+        self.flush()
+        self.db.execute('VACUUM')
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
 
-            self.cache[item] = method.hexdigest()
-            return self.cache[item]
+BACKENDS = dict(
+    dbm=Incremental,
+    sqlite=SQLiteIncremental,
+)
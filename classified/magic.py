@@ -20,8 +20,10 @@ Usage:
 import sys
 import glob
 import os.path
+import contextlib
 import ctypes
 import ctypes.util
+import queue
 import threading
 
 from ctypes import c_char_p, c_int, c_size_t, c_void_p
@@ -82,11 +84,7 @@ class Magic:
             return self._handle509Bug(e)
 
     def _handle509Bug(self, e):
-        # libmagic 5.09 has a bug where it might mail to identify the
-        # mimetype of a file and returns null from magic_file (and
-        # likely _buffer), but also does not return an error message.
-        if e.message is None and (self.flags & MAGIC_MIME):
-            return "application/octet-stream"
+        return _handle509Bug(e, self.flags)
 
     def _thread_check(self):
         if self.thread != threading.currentThread():
@@ -111,13 +109,129 @@ class Magic:
             self.cookie = None
 
 
-instances = threading.local()
+class MagicPool:
+    """
+    A fixed number of libmagic cookies, that can be checked out by any
+    thread. Each cookie is used by one thread at a time, so detection can run
+    concurrently (ctypes releases the GIL while libmagic is working).
+
+    """
+
+    def __init__(self, size=4, mime=False, magic_file=None):
+        """
+        Create a new pool of libmagic cookies, the cookies are created when
+        they are first needed.
+
+        size - maximum number of cookies
+        mime - if True, mimetypes are returned instead of textual descriptions
+        magic_file - use a mime database other than the system default
+        """
+        self.size = size
+        self.flags = MAGIC_NONE
+        if mime:
+            self.flags |= MAGIC_MIME
+        self.magic_file = magic_file
+
+        self.idle = queue.Queue()
+        self.cookies = []
+        self.lock = threading.Lock()
+
+    def _open(self):
+        cookie = magic_open(self.flags)
+        try:
+            magic_load(cookie, self.magic_file)
+        except MagicException:
+            magic_close(cookie)
+            raise
+        return cookie
+
+    def checkout(self):
+        """
+        Get a cookie, blocks until one is available if all cookies are in
+        use.
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if len(self.cookies) < self.size:
+                cookie = self._open()
+                self.cookies.append(cookie)
+                return cookie
+
+        return self.idle.get()
+
+    def checkin(self, cookie):
+        self.idle.put(cookie)
+
+    @contextlib.contextmanager
+    def cookie(self):
+        cookie = self.checkout()
+        try:
+            yield cookie
+        finally:
+            self.checkin(cookie)
+
+    def from_buffer(self, buf):
+        """
+        Identify the contents of `buf`
+        """
+        with self.cookie() as cookie:
+            try:
+                return magic_buffer(cookie, buf)
+            except MagicException as e:
+                return _handle509Bug(e, self.flags)
+
+    def from_file(self, filename):
+        """
+        Identify the contents of file `filename`
+        raises IOError if the file does not exist
+        """
+        if not os.path.exists(filename):
+            raise IOError("File does not exist: " + filename)
+        with self.cookie() as cookie:
+            try:
+                return magic_file(cookie, filename)
+            except MagicException as e:
+                return _handle509Bug(e, self.flags)
+
+    def close(self):
+        """
+        Close the idle cookies.
+        """
+        while True:
+            try:
+                cookie = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.cookies.remove(cookie)
+            magic_close(cookie)
+
+
+# Number of cookies in the pools used by the module functions
+POOL_SIZE = 4
+
+pools = {}
+pools_lock = threading.Lock()
 
 def _get_magic_type(mime):
-    i = instances.__dict__.get(mime)
-    if i is None:
-        i = instances.__dict__[mime] = Magic(mime=mime)
-    return i
+    pool = pools.get(mime)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(mime)
+            if pool is None:
+                pool = pools[mime] = MagicPool(POOL_SIZE, mime=mime)
+    return pool
+
+def _handle509Bug(e, flags):
+    # libmagic 5.09 has a bug where it might mail to identify the
+    # mimetype of a file and returns null from magic_file (and
+    # likely _buffer), but also does not return an error message.
+    if e.args[0] is None and (flags & MAGIC_MIME):
+        return b"application/octet-stream"
 
 def from_file(filename, mime=False):
     """"
@@ -181,7 +295,7 @@ def errorcheck_null(result, func, args):
         return result
 
 def errorcheck_negative_one(result, func, args):
-    if result is -1:
+    if result == -1:
         err = magic_error(args[0])
         raise MagicException(err)
     else:
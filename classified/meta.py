@@ -1,5 +1,6 @@
 # Python imports
 import bz2
+import collections
 import gzip
 import logging
 import os
@@ -32,8 +33,30 @@ except ImportError:
     magic = None  # pyflakes.ignore
     warnings.warn('Could not import required python-magic module')
     raise
+from classified import signature
 # Project imports (platform dependant)
-from classified.platform import get_filesystem, get_filesystems
+from classified.platform import get_mount_table
+
+
+# Names that versions of libmagic use for the same type, and the name used
+# throughout the scanner, so the detection modes agree
+MIMETYPE_ALIASES = {
+    'application/gzip': 'application/x-gzip',
+    'application/vnd.rar': 'application/x-rar',
+    'application/x-rar-compressed': 'application/x-rar',
+}
+
+
+def normalize_mimetype(mimetype):
+    '''
+    Returns the name the scanner uses for a mime type.
+
+    >>> normalize_mimetype('application/gzip')
+    'application/x-gzip'
+    >>> normalize_mimetype('text/plain')
+    'text/plain'
+    '''
+    return MIMETYPE_ALIASES.get(mimetype, mimetype)
 
 
 class CorruptionError(ValueError):
@@ -41,16 +64,25 @@ class CorruptionError(ValueError):
 
 
 class Path(object):
-    def __init__(self, path, parent=None):
+    # Many instances are created during a walk, so they have no __dict__
+    __slots__ = ('path', 'parent', '_stat', 'walkable', 'readable',
+                 '_repository_type')
+
+    def __init__(self, path, parent=None, stat=None, link=None):
         self.path = os.path.abspath(path)
         self.parent = parent
 
+        # Cached ``os.stat()`` result, usually provided by the walker
+        self._stat = stat
+
         # Flags used by recursor
         self.walkable = True
         self.readable = False
 
-        # Normalise path
-        if os.path.islink(self.path):
+        # Normalise path, the walker tells us if we're looking at a link
+        if link is None:
+            link = os.path.islink(self.path)
+        if link:
             result = os.readlink(self.path)
             if result.startswith(os.sep):
                 self.path = os.path.abspath(result)
@@ -59,16 +91,21 @@ class Path(object):
                     os.path.dirname(self.path), result
                 ))
 
-        # Proxy attributes
-        for attr in dir(self.path):
-            if attr.startswith('_'):
-                continue
-
-            elif hasattr(self, attr):
-                continue
-
-            else:
-                setattr(self, attr, getattr(self.path, attr))
+    def __getstate__(self):
+        # Open handles and the parent chain stay in this process
+        state = {}
+        for cls in self.__class__.__mro__:
+            for attr in getattr(cls, '__slots__', ()):
+                if hasattr(self, attr):
+                    state[attr] = getattr(self, attr)
+        state['parent'] = None
+        if 'handle' in state:
+            state['handle'] = None
+        return state
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
 
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.path)
@@ -76,6 +113,9 @@ class Path(object):
     def __str__(self):
         return self.path
 
+    def __fspath__(self):
+        return self.path
+
     def probe(cls, path):
         try:
             fileinfo = os.stat(path)
@@ -87,51 +127,199 @@ class Path(object):
 
     probe = classmethod(probe)
 
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def identity(self):
+        '''
+        File metadata that changes if the file is modified, or None if the
+        metadata can not be trusted.
+        '''
+        info = self.stat()
+        if info.st_ino <= 0 or info.st_mtime_ns is None:
+            return None
+
+        return '%d %d %d %d' % (
+            info.st_size,
+            info.st_mtime_ns,
+            info.st_ino,
+            info.st_ctime_ns,
+        )
+
+    def changed(self, identity):
+        '''
+        Test if an earlier ``identity`` of the item proves that the contents
+        changed, without reading them: files of another size changed.
+        '''
+        current = self.identity()
+        if current is None or identity is None:
+            return False
+        return current.split(' ', 1)[0] != identity.split(' ', 1)[0]
+
     def walk(self, recurse=True, depth=0, max_depth=10,
-             deflate=True, deflate_limit=0):
+             deflate=True, deflate_limit=0, exclude=None, links=True,
+             visited=None, select=None):
+        for item, level in self.walk_levels(recurse, depth, max_depth,
+                                            deflate, deflate_limit, exclude,
+                                            links, visited, select):
+            yield item
+
+    def walk_levels(self, recurse=True, depth=0, max_depth=10,
+                    deflate=True, deflate_limit=0, exclude=None, links=True,
+                    visited=None, select=None):
+        '''
+        Like :meth:`walk`, but yields tuples of the item and the depth of the
+        node it was found in. Directories for which ``exclude(path, entry)``
+        returns True, where ``entry`` is the ``os.DirEntry``, are skipped
+        without listing their contents. Files for which ``select(item)``
+        returns False are skipped before archive detection, which needs the
+        mime type. Symbolic links are skipped unless ``links`` is set.
+
+        The ``(st_dev, st_ino)`` of directories, and of files that have more
+        than one name, are kept in the ``visited`` set, so every inode is
+        yielded once. Pass the same set to walk multiple trees.
+        '''
 
         logging.debug('%s depth %d/%d' % (self.path, depth, max_depth))
 
-        for item in self.walk_tree(deflate, deflate_limit):
+        if visited is None:
+            visited = set()
+        try:
+            info = self.stat()
+        except (IOError, OSError):
+            pass
+        else:
+            visited.add((info.st_dev, info.st_ino))
+
+        # Depth first traversal using an explicit stack of iterators, instead
+        # of nesting generators for each level
+        stack = [(self, depth, self.walk_items(depth, max_depth, deflate,
+                                               deflate_limit, exclude, links,
+                                               visited, select))]
+        while stack:
+            node, level, iterator = stack[-1]
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stack.pop()
+                continue
+            except (IOError, OSError) as error:
+                logging.error('%s error %s' % (node.path, str(error)))
+                self.walk_failed(node)
+                stack.pop()
+                continue
+            except CorruptionError as error:
+                logging.error('%s is corrupt' % (node.path,))
+                self.walk_failed(node)
+                stack.pop()
+                continue
+
             if item is None:
                 continue
 
-            else:
-                yield item
+            yield item, level
+
+            if not recurse or not item.walkable:
+                continue
+
+            if max_depth and level >= max_depth:
+                logging.warning('%s max recursion depth' % (node.path,))
+                continue
+
+            logging.debug('%s depth %d/%d' % (item.path, level + 1,
+                max_depth))
+            stack.append((item, level + 1, item.walk_items(
+                depth=level + 1,
+                max_depth=max_depth,
+                deflate=deflate,
+                deflate_limit=deflate_limit,
+                exclude=exclude,
+                links=links,
+                visited=visited,
+                select=select,
+            )))
+
+    @staticmethod
+    def walk_failed(node):
+        # Archives that were not walked completely are not stored in the
+        # incremental cache
+        if isinstance(node, Archive):
+            node.complete = False
+
+    def walk_items(self, depth, max_depth, deflate, deflate_limit,
+                   exclude=None, links=True, visited=None, select=None):
+        return self.walk_tree(deflate, deflate_limit, exclude, links, visited,
+                              select)
+
+    def walk_tree(self, deflate, deflate_limit, exclude=None, links=True,
+                  visited=None, select=None):
+        try:
+            entries = os.scandir(self.path)
+        except (IOError, OSError):
+            logging.error('%s not accessible, skipping' % (self.path,))
+            return
 
-                if recurse and (max_depth and depth >= max_depth):
-                    logging.warning('%s max recursion depth' % (self.path,))
+        mount_hint = getattr(self, '_mount', None)
+        for entry in entries:
+            try:
+                link = entry.is_symlink()
+                if link and not links:
+                    logging.debug('skipping %s: symbolic link' % (entry.path,))
                     continue
 
-                if recurse and item.walkable:
-                    try:
-                        for sub in item.walk(depth=depth + 1, max_depth=max_depth):
-                            yield sub
-                    except (IOError, OSError) as error:
-                        logging.error('%s error %s' % (self.path, str(error)))
-                    except CorruptionError as error:
-                        logging.error('%s is corrupt' % (self.path,))
-
-    def walk_tree(self, deflate, deflate_limit):
-        if os.access(self.path, os.R_OK):
-            for item in os.listdir(self.path):
-                full = os.path.join(self.path, item)
-                if Path.probe(full):
-                    yield Path(full, parent=self)
+                if entry.is_dir():
+                    if exclude is not None and exclude(entry.path, entry):
+                        logging.debug('skipping %s: excluded directory' % (
+                            entry.path,))
+                        continue
+
+                    # Symbolic links and bind mounts may lead to a directory
+                    # that was visited before
+                    info = entry.stat()
+                    if visited is not None:
+                        key = (info.st_dev, info.st_ino)
+                        if key in visited:
+                            logging.debug('skipping %s: directory visited '
+                                          'before' % (entry.path,))
+                            continue
+                        visited.add(key)
+
+                    item = Path(entry.path, parent=self, stat=info,
+                                link=link)
                 else:
-                    mount_hint = getattr(self, '_mount', None)
-                    yield File.maybe(
-                        full,
-                        deflate_if_archive=deflate,
-                        deflate_limit=deflate_limit,
-                        mount_hint=mount_hint,
-                        parent=self,
-                    )
-        else:
-            logging.error('%s not accessible, skipping' % (self.path,))
+                    # One stat per file, reused by everything downstream
+                    info = entry.stat()
+
+                    # Hard links and symbolic links to files that were seen,
+                    # including the file a symbolic link that was walked
+                    # before points to. Files with a single name are not kept
+                    if visited is not None and stat.S_ISREG(info.st_mode):
+                        key = (info.st_dev, info.st_ino)
+                        if key in visited:
+                            logging.debug('skipping %s: file visited before'
+                                          % (entry.path,))
+                            continue
+                        if link or info.st_nlink > 1:
+                            visited.add(key)
+
+                    item = File(entry.path, parent=self, stat=info,
+                                link=link)
+                    if select is not None and not select(item):
+                        continue
+                    if deflate:
+                        item = item.deflated(deflate_limit, mount_hint)
+            except (IOError, OSError) as error:
+                logging.error('%s error %s' % (entry.path, str(error)))
+                continue
+
+            yield item
 
 
 class Repository(Path):
+    __slots__ = ('type',)
+
     supported_types = {
         # GNU Arch
         'arch': (
@@ -173,39 +361,81 @@ class Repository(Path):
             ('path', os.path.join('db', 'revs')),       # repository
         ),
     }
-    type_cache = {}
+    # Repository types of directories by path, including the directories
+    # that are not in a repository, least recently used entries are evicted
+    type_cache = collections.OrderedDict()
+    type_cache_size = 65536
 
-    def __init__(self, path):
-        super(Repository, self).__init__(path)
+    def __init__(self, path, parent=None):
+        super(Repository, self).__init__(path, parent=parent, link=False)
         self.type = self._detect_type()
 
     def _detect_type(self):
-        node = self
+        # Start at the directory that contains the file, files in archives are
+        # in the repository of the archive
+        node = self.parent
+        while isinstance(node, File):
+            node = node.parent
+        if node is None:
+            node = Path(os.path.dirname(self.path), link=False)
+
+        return self.directory_type(node)
+
+    @classmethod
+    def directory_type(cls, node):
+        '''
+        Repository type of a directory. The type is kept with the directory
+        and its parents, so the files found in a walk reuse the type of their
+        directory. The search stops at the boundary of the file system.
+        '''
+        pending = []
+        repository_type = None
         while node is not None:
-            # This only works for directories
-            if not isinstance(node, Path):
-                node = node.parent or Path(os.path.dirname(node.path))
             try:
-                return Repository.type_cache[node.path]
+                repository_type = node._repository_type
+                break
+            except AttributeError:
+                pass
+
+            try:
+                repository_type = cls.type_cache[node.path]
+                cls.type_cache.move_to_end(node.path)
+                break
             except KeyError:
-                repository_type = self._detect_type_path(node.path)
-
-            if repository_type is None:
-                if node.parent is None:
-                    path = os.path.dirname(node.path)
-                    # Stop iterating if we hit the file system root
-                    if path != node.path and os.path.isdir(path):
-                        node = Path(path)
-                    else:
-                        node = None
-                else:
-                    node = node.parent
-            else:
-                Repository.type_cache[node.path] = repository_type
-                return repository_type
+                pass
+
+            pending.append(node)
+            repository_type = cls._detect_type_path(node.path)
+            if repository_type is not None:
+                break
+
+            parent = node.parent
+            if parent is None:
+                path = os.path.dirname(node.path)
+                # Stop iterating if we hit the file system root
+                if path != node.path:
+                    parent = Path(path, link=False)
+
+            try:
+                if parent is not None and \
+                        parent.stat().st_dev != node.stat().st_dev:
+                    parent = None
+            except (IOError, OSError):
+                parent = None
+
+            node = parent
+
+        for node in pending:
+            node._repository_type = repository_type
+            cls.type_cache[node.path] = repository_type
+        while len(cls.type_cache) > cls.type_cache_size:
+            cls.type_cache.popitem(last=False)
+
+        return repository_type
 
-    def _detect_type_path(self, path):
-        for vendor, probes in self.supported_types.items():
+    @classmethod
+    def _detect_type_path(cls, path):
+        for vendor, probes in cls.supported_types.items():
             for filetype, filename in probes:
                 filepath = os.path.join(path, filename)
                 try:
@@ -234,10 +464,19 @@ class Repository(Path):
 
 
 class File(Path):
+    # The mime type, mount and repository are set when first used
+    __slots__ = ('handle', '_mimetype', '_mount', '_repository')
+
     Corrupt = CorruptionError
 
-    def __init__(self, path, parent):
-        super(File, self).__init__(path, parent=parent)
+    # Persistent mime type cache, shared by all instances
+    mimetype_cache = None
+    # Try the built-in signatures before libmagic
+    mimetype_sniff = False
+    header_size = signature.HEADER_SIZE
+
+    def __init__(self, path, parent=None, stat=None, link=None):
+        super(File, self).__init__(path, parent=parent, stat=stat, link=link)
 
         self.handle = None
 
@@ -262,26 +501,38 @@ class File(Path):
         )
 
     # Method that does archive detection
-    def maybe(path, deflate_if_archive=True, deflate_limit=0, mount_hint=None, parent=None):
-        instance = File(path, parent=parent)
-        if deflate_if_archive and instance.mimetype in Archive.supported_mimetypes:
-            if deflate_limit > 0 and instance.size > deflate_limit:
-                logging.warning('skipped archive %s: too big (%s > %s)' % \
-                    (instance, instance.size, deflate_limit))
-                return instance
-
-            try:
-                instance = Archive(path, mount_hint, parent=parent)
-                logging.debug('opened archive %s: %s' % (instance,
-                    instance.mimetype))
-            except CorruptionError as e:
-                logging.warn('failed to inspect archive %s: %s' % (instance,
-                    e))
-
+    def maybe(path, deflate_if_archive=True, deflate_limit=0, mount_hint=None,
+              parent=None, stat=None, link=None):
+        instance = File(path, parent=parent, stat=stat, link=link)
+        if deflate_if_archive:
+            return instance.deflated(deflate_limit, mount_hint)
         return instance
 
     maybe = staticmethod(maybe)
 
+    def deflated(self, deflate_limit=0, mount_hint=None):
+        '''
+        Returns the file opened as an :class:`Archive` if it is one, or the
+        file itself.
+        '''
+        if self.mimetype not in Archive.supported_mimetypes:
+            return self
+
+        if deflate_limit > 0 and self.size > deflate_limit:
+            logging.warning('skipped archive %s: too big (%s > %s)' % \
+                (self, self.size, deflate_limit))
+            return self
+
+        try:
+            instance = Archive(self.path, mount_hint, parent=self.parent,
+                               stat=self.stat(), link=False)
+            logging.debug('opened archive %s: %s' % (instance,
+                instance.mimetype))
+            return instance
+        except CorruptionError as e:
+            logging.warn('failed to inspect archive %s: %s' % (self, e))
+            return self
+
     # Low-level file like methods
 
     def __iter__(self):
@@ -292,10 +543,11 @@ class File(Path):
         return self
 
     def read(self, size=None):
+        # Decompressing handles raise their own errors on corrupt data
         try:
             return self.handle.read(size)
-        except (EOFError, IOError):
-            raise self.__class__.Corrupt(self.path)
+        except Exception as error:
+            raise self.__class__.Corrupt('%s: %s' % (self.path, error))
 
     def open(self, mode='r'):
         self.handle = open(self.path, mode)
@@ -305,9 +557,6 @@ class File(Path):
         self.handle.seek(offset, whence)
         return self
 
-    def stat(self):
-        return os.stat(self.path)
-
     def tell(self):
         return self.handle.tell()
 
@@ -321,13 +570,53 @@ class File(Path):
 
     def mimetype_get(self):
         if not hasattr(self, '_mimetype'):
-            try:
-                self._mimetype = magic.from_file(self.path, mime=True)
-                self._mimetype = self._mimetype.decode('ascii')
-            except NameError:
-                self._mimetype = None
+            key = None
+            if self.mimetype_cache is not None:
+                try:
+                    key = self.mimetype_key()
+                except (IOError, OSError):
+                    pass
+
+            mimetype = None
+            if key is not None:
+                mimetype = self.mimetype_cache.get(key)
+
+            # Signatures are checked first, they still need to read the header
+            # so their results are cached as well
+            header = None
+            if mimetype is None and self.mimetype_sniff:
+                header = self.mimetype_header()
+                if header is not None:
+                    mimetype = signature.sniff(header,
+                        complete=len(header) < self.header_size)
+                    if key is not None and mimetype is not None:
+                        self.mimetype_cache.set(key, mimetype)
+
+            if mimetype is None:
+                mimetype = self.mimetype_detect(header)
+                if key is not None and mimetype is not None:
+                    self.mimetype_cache.set(key, mimetype)
+
+            self._mimetype = normalize_mimetype(mimetype)
         return self._mimetype
 
+    def mimetype_header(self):
+        try:
+            with open(self.path, 'rb') as handle:
+                return handle.read(self.header_size)
+        except (IOError, OSError):
+            return None
+
+    def mimetype_detect(self, header=None):
+        # libmagic reads beyond the header, so let it inspect the file
+        try:
+            return magic.from_file(self.path, mime=True).decode('ascii')
+        except NameError:
+            return None
+
+    def mimetype_key(self):
+        return self.mimetype_cache.key(self.stat())
+
     def mimetype_set(self, mimetype):
         self._mimetype = mimetype
 
@@ -335,7 +624,11 @@ class File(Path):
 
     def mount_get(self):
         if not hasattr(self, '_mount'):
-            self._mount = Mount(self.path)
+            try:
+                info = self.stat()
+            except (IOError, OSError):
+                info = None
+            self._mount = Mount(self.path, stat=info)
         return self._mount
 
     def mount_set(self, mount):
@@ -350,7 +643,7 @@ class File(Path):
 
     def repository_get(self):
         if not hasattr(self, '_repository'):
-            self._repository = Repository(self.path)
+            self._repository = Repository(self.path, parent=self.parent)
         return self._repository
 
     repository = property(repository_get)
@@ -362,20 +655,24 @@ class File(Path):
 
 
 class Mount(Path):
-    def __init__(self, path):
-        super(Mount, self).__init__(path)
+    __slots__ = ('fs',)
+
+    def __init__(self, path, stat=None):
+        super(Mount, self).__init__(path, stat=stat)
         self.fs = self._detect_fs()
 
     def _detect_fs(self):
-        if not hasattr(Mount, '_fs_cache') or \
-                Mount._fs_cache_timeout < time.time():
-            setattr(Mount, '_fs_cache', list(get_filesystems()))
-            setattr(Mount, '_fs_cache_timeout', time.time() + 60)
+        # Archive members have no device, they are found by their path
+        dev = None
+        if self._stat is not None and self._stat.st_dev > 0:
+            dev = self._stat.st_dev
 
-        return get_filesystem(str(self), Mount._fs_cache)
+        return get_mount_table().lookup(str(self), dev)
 
 
 class Archive(File):
+    __slots__ = ('bundle', 'recursor', 'complete')
+
     supported_mimetypes = [
         'application/x-bzip2',
         'application/x-gzip',
@@ -383,12 +680,16 @@ class Archive(File):
         'application/zip',
     ]
 
-    def __init__(self, path, mount_hint=None, parent=None):
-        super(Archive, self).__init__(path, parent=parent)
+    def __init__(self, path, mount_hint=None, parent=None, stat=None,
+                 link=None):
+        super(Archive, self).__init__(path, parent=parent, stat=stat,
+                                      link=link)
 
         # Flags used by recursor
         self.walkable = True
         self.readable = False
+        # Cleared if the members could not all be listed
+        self.complete = True
 
         if not mount_hint is None:
             self._mount = mount_hint
@@ -419,8 +720,7 @@ class Archive(File):
                         self.handle = lzma.LZMAFile(self.path, mode='r')
 
                 # Override mimetype by the mimetype of the compressed file
-                self.mimetype = magic.from_buffer(self.read(1024), mime=True)
-                self.mimetype = self.mimetype.decode('ascii')
+                self.mimetype = self.compressed_mimetype()
 
         elif mimetype == 'x-rar' and rarfile is not None:
             try:
@@ -441,6 +741,21 @@ class Archive(File):
             self.recursor = self._recursor_zip
             self.handle = zipfile.ZipFile(self.path)
 
+    def compressed_mimetype(self):
+        # Cached with the key of the member, which has the same contents
+        key = None
+        if self.mimetype_cache is not None:
+            key = self.mimetype_cache.key(self.stat(), os.sep)
+            mimetype = self.mimetype_cache.get(key)
+            if mimetype is not None:
+                return mimetype
+
+        mimetype = magic.from_buffer(self.read(1024), mime=True)
+        mimetype = normalize_mimetype(mimetype.decode('ascii'))
+        if key is not None:
+            self.mimetype_cache.set(key, mimetype)
+        return mimetype
+
     def _recursor_compressed(self, depth, max_depth):
         yield ArchiveFile(self.path, self)
 
@@ -481,13 +796,25 @@ class Archive(File):
             except KeyError:  # File not in archive
                 pass
 
+    def open(self, mode='r'):
+        # Keep the handle of the archive, and read the archive file as is
+        return File(self.path, stat=self.stat(), link=False).open(mode)
+
     def walk(self, depth=0, max_depth=10):
         if self.walkable and (not max_depth or depth < max_depth):
             for item in self.recursor(depth=depth+1, max_depth=max_depth):
                 yield item
 
+    def walk_items(self, depth, max_depth, deflate, deflate_limit,
+                   exclude=None, links=True, visited=None, select=None):
+        return self.walk(depth=depth, max_depth=max_depth)
+
 
 class ArchiveFile(File):
+    __slots__ = ('archive', 'filename', 'member')
+
+    header_size = 1024
+
     def __init__(self, path, archive):
         super(ArchiveFile, self).__init__(path, parent=archive)
 
@@ -641,18 +968,69 @@ class ArchiveFile(File):
                 time.mktime(self.member.date_time + (0, 0, 0)),
             ))
 
-    def mimetype_get(self):
-        if not hasattr(self, '_mimetype'):
-            try:
-                self.open('rb')
-            except CorruptionError:
-                self._mimetype = None
-            else:
-                self._mimetype = magic.from_buffer(self.read(1024), mime=True)
-                self._mimetype = self._mimetype.decode('ascii')
-        return self._mimetype
+    def identity(self):
+        '''
+        Container metadata that changes if the member is modified, read
+        without decompressing the member.
+        '''
+        if rarfile and isinstance(self.archive.handle, rarfile.RarFile):
+            return 'rar %08x %d' % (self.member.CRC, self.member.file_size)
+
+        elif isinstance(self.archive.handle, zipfile.ZipFile):
+            return 'zip %08x %d' % (self.member.CRC, self.member.file_size)
+
+        # Members of tar archives and compressed files have no checksum, so
+        # they also depend on the archive
+        archive = self.archive.identity()
+        if archive is None:
+            return None
+
+        elif isinstance(self.archive.handle, tarfile.TarFile):
+            return 'tar %d %d %d %s' % (self.member.size, self.member.mtime,
+                                        self.member.offset_data, archive)
 
-    mimetype = property(mimetype_get)
+        return archive
+
+    def changed(self, identity):
+        '''
+        Test if an earlier ``identity`` of the member proves that the contents
+        changed. Members of compressed files are identified by the compressed
+        file, which tells nothing about the contents.
+        '''
+        current = self.identity()
+        if current is None or identity is None or current == identity:
+            return False
+
+        kind = current.split(' ', 1)[0]
+        if kind in ('rar', 'zip'):
+            # Identified by the CRC32 and size of the contents
+            return True
+        elif kind == 'tar':
+            return current.split(' ', 2)[:2] != identity.split(' ', 2)[:2]
+        return False
+
+    def mimetype_header(self):
+        try:
+            self.open('rb')
+            return self.read(self.header_size)
+        except CorruptionError as error:
+            logging.error('could not read %s' % (error,))
+            self.readable = False
+            return None
+
+    def mimetype_detect(self, header=None):
+        if header is None:
+            header = self.mimetype_header()
+        if header is None:
+            return None
+        return magic.from_buffer(header, mime=True).decode('ascii')
+
+    def mimetype_key(self):
+        # Members are keyed by the archive and their name in the archive
+        return self.mimetype_cache.key(self.archive.stat(),
+                                       os.sep + self.filename)
+
+    mimetype = property(File.mimetype_get)
 
 
 # Support for these mime types depend on the availability of third party
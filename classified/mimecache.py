@@ -0,0 +1,152 @@
+# Python imports
+import logging
+import os
+import sqlite3
+import time
+
+
+class MimetypeCache(object):
+    '''
+    Persistent cache of detected mime types, keyed by the identity of the
+    file: device, inode, size and modification time. Files in archives are
+    keyed by the identity of the archive and the name of the member. The
+    entries of the fast and strict detection modes are kept apart. If the
+    cache grows beyond its size, the least recently used entries are evicted.
+    '''
+
+    default_size = 1000000
+    # Number of changes kept in memory before they are written
+    batch_size = 1024
+
+    def __init__(self, config):
+        self.config = config
+
+        # Configuration bits
+        self.database = self.config.get('mimetype', 'database')
+        try:
+            self.size = self.config.getint('mimetype', 'size')
+        except self.config.NoOptionError:
+            self.size = self.default_size
+
+        # Detection mode that produced the cached mime types
+        self.mode = self.config.getdefault('scanner', 'magic', 'strict')
+
+        # Entries are marked with the time of the run that last used them
+        self.used = int(time.time())
+        self.added = []
+        self.touched = []
+
+        # Create the database in secure mode, it tells what kind of files
+        # are on the system and holds the names of archive members
+        if not os.path.exists(self.database):
+            os.close(os.open(self.database, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        self.db = sqlite3.connect(self.database, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            # Caches of older versions did not record the detection mode
+            columns = [
+                row[1]
+                for row in self.db.execute('PRAGMA table_info(mimetype)')
+            ]
+            if columns and 'mode' not in columns:
+                self.db.execute('DROP TABLE mimetype')
+
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS mimetype (
+                    mode        TEXT NOT NULL,
+                    dev         INTEGER NOT NULL,
+                    ino         INTEGER NOT NULL,
+                    size        INTEGER NOT NULL,
+                    mtime       INTEGER NOT NULL,
+                    member      TEXT NOT NULL,
+                    mimetype    TEXT NOT NULL,
+                    used        INTEGER NOT NULL,
+                    PRIMARY KEY (mode, dev, ino, size, mtime, member)
+                )
+            ''')
+            self.db.execute('''
+                CREATE INDEX IF NOT EXISTS mimetype_used ON mimetype (used)
+            ''')
+
+        # Number of entries, kept up to date with our own changes and counted
+        # again before evicting, as other processes share the cache
+        self.count = self.db.execute(
+            'SELECT COUNT(*) FROM mimetype').fetchone()[0]
+
+        logging.debug('caching mime types in %s' % self.database)
+
+    def key(self, info, member=''):
+        '''
+        Cache key for a ``os.stat()`` result and the (optional) name of the
+        member in an archive.
+        '''
+        return (self.mode, info.st_dev, info.st_ino, info.st_size,
+                info.st_mtime_ns, member)
+
+    def get(self, key):
+        row = self.db.execute('''
+            SELECT mimetype, used FROM mimetype
+            WHERE mode = ? AND dev = ? AND ino = ? AND size = ? AND mtime = ?
+                AND member = ?
+        ''', key).fetchone()
+        if row is None:
+            return None
+
+        if row[1] != self.used:
+            self.touched.append(key)
+            self.flush_maybe()
+        return row[0]
+
+    def set(self, key, mimetype):
+        self.added.append(key + (mimetype, self.used))
+        self.flush_maybe()
+
+    def flush_maybe(self):
+        if len(self.added) + len(self.touched) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.added and not self.touched:
+            return
+
+        added, self.added = self.added, []
+        touched, self.touched = self.touched, []
+        try:
+            with self.db:
+                # Entries added by another process have the same mime type
+                cursor = self.db.executemany('''
+                    INSERT OR IGNORE INTO mimetype
+                    (mode, dev, ino, size, mtime, member, mimetype, used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', added)
+                self.count += max(cursor.rowcount, 0)
+                self.db.executemany('''
+                    UPDATE mimetype SET used = ?
+                    WHERE mode = ? AND dev = ? AND ino = ? AND size = ?
+                        AND mtime = ? AND member = ?
+                ''', [(self.used,) + key for key in touched])
+                if self.count > self.size:
+                    self.evict()
+        except sqlite3.Error as error:
+            # It's only a cache, other processes may hold the lock
+            logging.warning('%s: could not update mime type cache: %s' % (
+                self.database, error))
+
+    def evict(self):
+        self.count = self.db.execute(
+            'SELECT COUNT(*) FROM mimetype').fetchone()[0]
+        if self.count > self.size:
+            logging.debug('evicting %d entries from the mime type cache' % (
+                self.count - self.size,))
+            self.db.execute('''
+                DELETE FROM mimetype WHERE rowid IN (
+                    SELECT rowid FROM mimetype ORDER BY used LIMIT ?
+                )
+            ''', (self.count - self.size,))
+            self.count = self.size
+
+    def close(self):
+        self.flush()
+        self.db.close()
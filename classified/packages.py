@@ -0,0 +1,174 @@
+'''
+Index of the files installed by the package manager, with the checksums of
+their packaged contents. Files that still have their packaged contents are not
+probed.
+'''
+
+# Python imports
+import binascii
+import collections
+import glob
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import time
+
+# Project imports
+from classified import checksum
+
+
+# Digest algorithms by the size of their digest
+ALGORITHMS = {
+    16: 'md5',
+    20: 'sha1',
+    28: 'sha224',
+    32: 'sha256',
+    48: 'sha384',
+    64: 'sha512',
+}
+
+# Files of all installed rpm packages, with the size and digest
+RPM_QUERY = '[%{FILENAMES}\\t%{FILESIZES}\\t%{FILEDIGESTS}\\n]'
+
+# Packed size of a packaged file, followed by the digest
+SIZE = struct.Struct('>q')
+
+
+class Packages(object):
+    '''
+    Packaged files by path, with the size (or -1 if the package manager does
+    not record the size) and the digest of their packaged contents, packed in
+    a single string per file. The package databases are read when the first
+    file is verified, or before the worker processes are started.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.dpkg = self.config.getdefault('packages', 'dpkg', '/var/lib/dpkg')
+        self.rpm = self.config.getdefault('packages', 'rpm', 'rpm')
+
+        self.files = None
+        self.realpaths = {}
+        self.stats = collections.Counter()
+
+    def log_stats(self):
+        if self.stats:
+            logging.info('packages: %d verified, %d modified' % (
+                self.stats['verified'], self.stats['modified']))
+
+    def load(self):
+        start = time.time()
+        self.files = {}
+        if os.path.isdir(os.path.join(self.dpkg, 'info')):
+            self.load_dpkg()
+
+        rpm = shutil.which(self.rpm)
+        if rpm is not None:
+            self.load_rpm(rpm)
+
+        # Only needed while loading
+        self.realpaths = {}
+        logging.info('packages: indexed %d files in %.3fs' % (
+            len(self.files), time.time() - start))
+
+    def add(self, path, size, digest):
+        # Packaged paths may be below a symlinked directory, such as /bin on
+        # systems with a merged /usr
+        directory, name = os.path.split(path)
+        try:
+            realpath = self.realpaths[directory]
+        except KeyError:
+            realpath = self.realpaths[directory] = os.path.realpath(directory)
+        self.files[os.path.join(realpath, name)] = SIZE.pack(size) + digest
+
+    def load_dpkg(self):
+        for filename in glob.glob(os.path.join(self.dpkg, 'info', '*.md5sums')):
+            try:
+                with open(filename, 'rb') as handle:
+                    for line in handle:
+                        try:
+                            digest, path = line.rstrip(b'\n').split(b'  ', 1)
+                            self.add(os.sep + os.fsdecode(path), -1,
+                                     binascii.unhexlify(digest))
+                        except (ValueError, binascii.Error):
+                            continue
+            except (IOError, OSError) as error:
+                logging.warning('%s: could not read package checksums: %s' % (
+                    filename, error))
+
+        # Configuration files, with the checksum of their packaged version
+        status = os.path.join(self.dpkg, 'status')
+        try:
+            with open(status, 'rb') as handle:
+                conffiles = False
+                for line in handle:
+                    if line.startswith(b'Conffiles:'):
+                        conffiles = True
+                    elif conffiles and line.startswith(b' '):
+                        part = line.split()
+                        try:
+                            self.add(os.fsdecode(part[0]), -1,
+                                     binascii.unhexlify(part[1]))
+                        except (IndexError, ValueError, binascii.Error):
+                            continue
+                    else:
+                        conffiles = False
+        except (IOError, OSError) as error:
+            logging.warning('%s: could not read package status: %s' % (
+                status, error))
+
+    def load_rpm(self, rpm):
+        try:
+            output = subprocess.run([rpm, '-qa', '--qf', RPM_QUERY],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL,
+                                    check=True).stdout
+        except (OSError, subprocess.CalledProcessError) as error:
+            logging.warning('%s: could not query packages: %s' % (rpm, error))
+            return
+
+        for line in output.splitlines():
+            try:
+                path, size, digest = line.split(b'\t')
+                # Directories and links have no digest
+                if digest:
+                    self.add(os.fsdecode(path), int(size),
+                             binascii.unhexlify(digest))
+            except (ValueError, binascii.Error):
+                continue
+
+    def verify(self, item):
+        '''
+        Test if the item is a packaged file with its packaged contents.
+        '''
+        if self.files is None:
+            self.load()
+
+        try:
+            value = self.files[item.path]
+        except KeyError:
+            return False
+
+        size, = SIZE.unpack_from(value)
+        digest = value[SIZE.size:]
+
+        algorithm = ALGORITHMS.get(len(digest))
+        if algorithm is None:
+            return False
+
+        try:
+            if size >= 0 and item.size != size:
+                verified = False
+            else:
+                hashing = checksum.new(algorithm)
+                with open(item.path, 'rb') as handle:
+                    for chunk in iter(lambda: handle.read(65536), b''):
+                        hashing.update(chunk)
+                verified = hashing.digest() == digest
+        except (IOError, OSError):
+            return False
+
+        self.stats['verified' if verified else 'modified'] += 1
+        return verified
@@ -0,0 +1,87 @@
+'''
+Compiled index of path patterns, used for exclusions. Patterns are globs that
+match the full path, where ``*`` also matches the path separator. Literal paths
+and patterns like ``*/name`` are looked up in a set, all other patterns are
+combined into a single regular expression.
+'''
+
+# Python imports
+import fnmatch
+import os
+import re
+
+
+GLOB = re.compile(r'[*?\[]')
+
+
+class PathIndex(object):
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self.paths = set()
+        self.names = set()
+
+        globs = []
+        subtrees = []
+        for pattern in self.patterns:
+            if not GLOB.search(pattern):
+                self.paths.add(pattern)
+            elif pattern.startswith('*' + os.sep) and \
+                    not GLOB.search(pattern[2:]) and os.sep not in pattern[2:]:
+                self.names.add(pattern[2:])
+            else:
+                globs.append(pattern)
+
+            # Patterns ending in a wildcard match everything below a directory
+            # that matches the rest of the pattern
+            if pattern.endswith('*'):
+                subtrees.append(pattern[:-1])
+
+        self.regex = self.compile(globs)
+        self.subtree_regex = self.compile(subtrees)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __repr__(self):
+        return 'PathIndex(%r)' % (self.patterns,)
+
+    @staticmethod
+    def compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(
+            fnmatch.translate(pattern)
+            for pattern in patterns
+        ))
+
+    def match(self, path):
+        '''
+        Test if the path matches any of the patterns.
+
+        >>> index = PathIndex(['/tmp', '*/.git', '/home/*/tmp'])
+        >>> index.match('/tmp'), index.match('/tmp/x')
+        (True, False)
+        >>> index.match('/srv/project/.git')
+        True
+        >>> index.match('/home/maze/tmp')
+        True
+        '''
+        if path in self.paths:
+            return True
+        elif self.names and os.path.basename(path) in self.names:
+            return True
+        elif self.regex is not None:
+            return self.regex.match(path) is not None
+        return False
+
+    def covers(self, directory):
+        '''
+        Test if all paths below the directory match one of the patterns.
+
+        >>> index = PathIndex(['/etc/ssl/private/*'])
+        >>> index.covers('/etc/ssl/private'), index.covers('/etc/ssl')
+        (True, False)
+        '''
+        if self.subtree_regex is None:
+            return False
+        return self.subtree_regex.match(directory + os.sep) is not None
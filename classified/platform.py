@@ -1,13 +1,23 @@
 # Python imports
 import os
+import re
+import select
 import subprocess
 import sys
+import time
 try:
     import win32com.client
 except ImportError:
     pass
 
 
+MOUNTINFO = '/proc/self/mountinfo'
+ESCAPED = re.compile(r'\\([0-7]{3})')
+
+# Mount table, see :func:`get_mount_table`
+MOUNT_TABLE = None
+
+
 def get_filesystem(path, filesystems=None):
     '''
     Get the filesystem of a given path.
@@ -18,14 +28,17 @@ def get_filesystem(path, filesystems=None):
 
     filesystems_match = []
     for filesystem in filesystems:
-        if path.startswith(filesystem['mount']):
+        mount = filesystem['mount']
+        if path == mount or path.startswith(mount.rstrip(os.sep) + os.sep):
             filesystems_match.append(filesystem)
 
-    # Sort by longest matching path
+    # Sort by longest matching path, the last mount on a path hides the
+    # previous mounts
     def _mount(filesystem):
-        return filesystem['mount']
+        return len(filesystem['mount'])
 
-    filesystems_match.sort(key=_mount)
+    filesystems_match.reverse()
+    filesystems_match.sort(key=_mount, reverse=True)
     return filesystems_match[0]
 
 
@@ -44,6 +57,41 @@ def get_filesystems():
 
 def _get_filesystems_linux():
     '''List mounted file systems on Linux.'''
+    if os.path.exists(MOUNTINFO):
+        return _get_filesystems_mountinfo()
+    return _get_filesystems_mtab()
+
+
+def _unescape(field):
+    # Spaces, tabs, newlines and backslashes are escaped as octal
+    return ESCAPED.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def _get_filesystems_mountinfo():
+    '''
+    List mounted file systems from ``/proc/self/mountinfo``, which includes
+    the device number of each mount.
+    '''
+    with open(MOUNTINFO, 'r') as handle:
+        for line in handle:
+            part = line.split()
+            try:
+                # Optional fields are terminated by a single hyphen
+                split = part.index('-', 6)
+                major, minor = part[2].split(':')
+                yield {
+                    'device': _unescape(part[split + 2]),
+                    'mount': _unescape(part[4]),
+                    'type': part[split + 1],
+                    'options': part[5].split(','),
+                    'dev': os.makedev(int(major), int(minor)),
+                }
+            except (IndexError, ValueError):
+                continue
+
+
+def _get_filesystems_mtab():
+    '''List mounted file systems from ``/etc/mtab``.'''
     with open('/etc/mtab', 'r') as handle:
         for line in handle:
             part = line.split()
@@ -82,6 +130,71 @@ def _get_filesystems_windows():
             'mount': item.VolumeName,
         }
 
+class MountTable(object):
+    '''
+    Mounted file systems, indexed by device number. The table is reloaded
+    when the kernel signals a change in the mount table, or periodically on
+    platforms that do not signal changes.
+    '''
+
+    # Reload interval if changes are not signalled
+    timeout = 60
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.poll = None
+        if hasattr(select, 'poll') and os.path.exists(MOUNTINFO):
+            self.handle = open(MOUNTINFO, 'r')
+            self.poll = select.poll()
+            self.poll.register(self.handle, select.POLLPRI)
+        self.load()
+
+    def load(self):
+        self.filesystems = list(get_filesystems())
+        self.devices = {}
+        for filesystem in reversed(self.filesystems):
+            # Bind mounts share the device of the mounted file system
+            if filesystem.get('dev') is not None:
+                self.devices.setdefault(filesystem['dev'], filesystem)
+        self.expires = time.time() + self.timeout
+
+    def changed(self):
+        if self.poll is None:
+            return self.expires < time.time()
+
+        for fd, event in self.poll.poll(0):
+            if event & (select.POLLPRI | select.POLLERR):
+                return True
+        return False
+
+    def lookup(self, path, dev=None):
+        '''
+        Get the file system of a path, by its device number if available.
+        '''
+        if self.changed():
+            self.load()
+
+        if dev is not None:
+            try:
+                return self.devices[dev]
+            except KeyError:
+                pass
+
+        return get_filesystem(path, self.filesystems)
+
+
+def get_mount_table():
+    '''
+    Get the mount table of this process.
+    '''
+    global MOUNT_TABLE
+    # A forked process has its own table, the events on the shared handle
+    # would only be seen by one of the processes
+    if MOUNT_TABLE is None or MOUNT_TABLE.pid != os.getpid():
+        MOUNT_TABLE = MountTable()
+    return MOUNT_TABLE
+
+
 if __name__ == '__main__':
     filesystems = list(get_filesystems())
     print('{} file systems mounted:'.format(len(filesystems)))
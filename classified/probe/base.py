@@ -1,16 +1,15 @@
 # Python imports
-import fnmatch
-import grp
 import logging
 import os
-import pwd
-import re
 import stat
 import sys
 
 # Project imports
 from classified import checksum
+from classified.hashstore import get_hashstore
+from classified.pathindex import PathIndex
 from classified.probe import PROBES, IGNORE
+from classified.utils import username, groupname
 
 
 class ProbeTracker(type):
@@ -28,6 +27,7 @@ class Probe(object, metaclass=ProbeTracker):
     target = ()                     # default list of target mime types
     format = None                   # default format string for reporting
     name = None
+    chunked = False                 # implements start(), feed() and finish()
 
     def __init__(self, config, report, buffer=None):
         self.config = config
@@ -46,40 +46,79 @@ class Probe(object, metaclass=ProbeTracker):
 
         # See if the ignores are already parsed
         if self.name not in IGNORE:
-            IGNORE[self.name] = dict(name=[], hash=[])
+            IGNORE[self.name] = dict(name=[], hash=set(), store=None)
 
             # Ignored hashes
             try:
                 ignore_hash = self.config.getmulti('clean:%s' % self.name,
                     'ignore_hash')
-                IGNORE[self.name]['hash'] = ignore_hash
+                IGNORE[self.name]['hash'] = set(ignore_hash)
             except (self.config.NoOptionError, self.config.NoSectionError):
-                IGNORE[self.name]['hash'] = []
+                IGNORE[self.name]['hash'] = set()
+
+            # Ignored hashes in a hash store, shared by the probes
+            filename = self.config.getdefault('clean:%s' % self.name,
+                'ignore_hash_store',
+                self.config.getdefault('clean', 'ignore_hash_store', None)
+            )
+            if filename:
+                store = get_hashstore(filename)
+                if store.digest_size != checksum.new(
+                        self.algorithm).digest_size:
+                    logging.warning('%s: hash store does not contain %s '
+                                    'digests, not used by probe %s' % (
+                                        filename, self.algorithm, self.name))
+                else:
+                    IGNORE[self.name]['store'] = store
 
             # Ignored names
             try:
                 ignore_name = self.config.getmulti('clean:%s' % self.name,
                     'ignore_name')
-                IGNORE[self.name]['name'] = [re.compile(fnmatch.translate(pattern)) for pattern in ignore_name]
+                IGNORE[self.name]['name'] = PathIndex(ignore_name)
             except (self.config.NoOptionError, self.config.NoSectionError):
-                IGNORE[self.name]['name'] = []
+                IGNORE[self.name]['name'] = PathIndex()
 
             # Ignored repos
             try:
                 ignore_repo = self.config.getmulti('clean:%s' % self.name,
                     'ignore_repo')
-                IGNORE[self.name]['repo'] = []
+                patterns = {}
                 for ignore in ignore_repo:
                     repo_type, pattern = ignore.split(':', 1)
-                    IGNORE[self.name]['repo'].append((
-                        repo_type, re.compile(fnmatch.translate(pattern))
-                    ))
+                    patterns.setdefault(repo_type, []).append(pattern)
+                IGNORE[self.name]['repo'] = dict(
+                    (repo_type, PathIndex(patterns[repo_type]))
+                    for repo_type in patterns
+                )
             except (self.config.NoOptionError, self.config.NoSectionError):
-                IGNORE[self.name]['repo'] = []
+                IGNORE[self.name]['repo'] = {}
+
+        # Fingerprint of the probe settings, so incremental results of this
+        # probe are void if the settings change
+        self.fingerprint = self.get_fingerprint()
 
     def __unicode__(self):
         return self.name
 
+    def get_fingerprint(self):
+        hashing = checksum.new('sha1')
+        hashing.update(self.name.encode('utf-8'))
+        for section in ('clean', 'clean:%s' % self.name,
+                        'probe:%s' % self.name):
+            if not self.config.has_section(section):
+                continue
+            for option, value in sorted(self.config.items(section, raw=True)):
+                hashing.update(('\0%s\0%s=%s' % (
+                    section, option, value)).encode('utf-8'))
+
+        # Hashes are added to the store without changing the settings
+        store = IGNORE[self.name]['store']
+        if store is not None:
+            hashing.update(('\0%s\0%s' % (
+                store.filename, store.identity)).encode('utf-8'))
+        return hashing.hexdigest()
+
     def can_probe(self, item):
         '''
         Tests if this probe can be ran against the given item.
@@ -104,33 +143,37 @@ class Probe(object, metaclass=ProbeTracker):
         )
 
         # Calculate checksum using the selected algorith, and check if it is in
-        # the ignore list for this probe
-        hashing = checksum.new(self.algorithm)
+        # the ignore list for this probe. The checksum of the file is the
+        # same for all findings in the item
         if context == 'file':
-            for line in item.open('rb'):
-                hashing.update(line)
-
-        elif context == 'line':
-            try:
-                if isinstance(kwargs['raw'], str):
-                    hashing.update(kwargs['raw'].encode('utf-8'))
-                else:
-                    hashing.update(kwargs['raw'])
-            except KeyError:
-                # The reported item has no "raw" format, therefor we can not
-                # provide a line-based hash
-                return None, False
-
-        elif context == 'format':
-            format = self.config.get('clean:%s' % self.name, 'format')
-            hashing.update(format.format(**kwargs))
+            digest, binary = get_context(item).checksum(self.algorithm)
 
         else:
-            raise TypeError('Probe %s does not support %s context' % \
-                (self.name, context))
-
-        digest = hashing.hexdigest()
-        if digest in IGNORE[self.name]['hash']:
+            hashing = checksum.new(self.algorithm)
+            if context == 'line':
+                try:
+                    if isinstance(kwargs['raw'], str):
+                        hashing.update(kwargs['raw'].encode('utf-8'))
+                    else:
+                        hashing.update(kwargs['raw'])
+                except KeyError:
+                    # The reported item has no "raw" format, therefor we can
+                    # not provide a line-based hash
+                    return None, False
+
+            elif context == 'format':
+                format = self.config.get('clean:%s' % self.name, 'format')
+                hashing.update(format.format(**kwargs).encode('utf-8'))
+
+            else:
+                raise TypeError('Probe %s does not support %s context' % \
+                    (self.name, context))
+
+            digest, binary = hashing.hexdigest(), hashing.digest()
+
+        store = IGNORE[self.name]['store']
+        if digest in IGNORE[self.name]['hash'] or \
+                (store is not None and binary in store):
             logging.debug('ignoring %r in %s: %s' % (item, self.name, digest))
             return digest, True
         else:
@@ -141,29 +184,58 @@ class Probe(object, metaclass=ProbeTracker):
         '''
         Check if the full path is to be ignored by this type of probe.
         '''
-        for pattern in IGNORE[self.name]['name']:
-            if pattern.match(str(item)):
-                return True
-        return False
+        return IGNORE[self.name]['name'].match(str(item))
+
+    def ignore_tree(self, path):
+        '''
+        Check if all files below the directory are ignored by this type of
+        probe.
+        '''
+        return IGNORE[self.name]['name'].covers(path)
 
     def ignore_repo(self, item):
         '''
         Check if the full path is to be ignored by this type of probe.
         '''
-        if item.repository.type is None:
+        if not IGNORE[self.name]['repo'] or item.repository.type is None:
             return False
 
-        for repository_type, pattern in IGNORE[self.name]['repo']:
-            if repository_type not in (item.repository.type, 'any'):
-                continue
-            if pattern.match(str(item)):
+        for repository_type in (item.repository.type, 'any'):
+            index = IGNORE[self.name]['repo'].get(repository_type)
+            if index is not None and index.match(str(item)):
                 return True
 
         return False
 
     def probe(self, item):
+        '''
+        Run the probe against the given item. Probes that implement the chunk
+        feeding interface read the item by themselves.
+        '''
+        if self.chunked:
+            feed_probes(item, [self])
+        else:
+            raise NotImplementedError
+
+    def start(self, item):
+        '''
+        Prepare for feeding the contents of a new item.
+        '''
+        pass
+
+    def feed(self, item, chunk):
+        '''
+        Process a chunk of the item contents, return ``False`` if the probe
+        does not need any more data.
+        '''
         raise NotImplementedError
 
+    def finish(self, item):
+        '''
+        Called after the last chunk of the item was fed.
+        '''
+        pass
+
     def record(self, item, **kwargs):
         # Check if we can/may report this item
         digest, ignore = self.ignore_hash(item, **kwargs)
@@ -172,25 +244,197 @@ class Probe(object, metaclass=ProbeTracker):
 
         # Exend kwargs
         kwargs['hash'] = digest
-        kwargs['filename'] = str(item)
-        kwargs['filename_relative'] = str(item).replace(os.getcwd(), '.')
-
-        # Find out who owns the file
-        info = item.stat()
-        kwargs['uid'] = info[stat.ST_UID]
-        kwargs['gid'] = info[stat.ST_GID]
-        try:
-            kwargs['username'] = pwd.getpwuid(kwargs['uid'])[0]
-        except KeyError:
-            kwargs['username'] = str(kwargs['uid'])
-        try:
-            kwargs['group'] = grp.getgrgid(kwargs['gid'])[0]
-        except KeyError:
-            kwargs['group'] = str(kwargs['gid'])
+        self.describe(item, kwargs)
 
         # Send findings to reporting engine
         self.report.report(self, item, **kwargs)
 
+    def describe(self, item, kwargs):
+        '''
+        Add the name and the owner of the item to the finding, this is also
+        used to report a finding for another item with the same contents.
+        '''
+        kwargs.update(get_context(item).describe())
+
+
+class Context(object):
+    '''
+    Details of an item that are the same for all its findings, computed when
+    the first finding needs them.
+    '''
+
+    __slots__ = ('item', 'details', 'checksums')
+
+    def __init__(self, item):
+        self.item = item
+        self.details = None
+        self.checksums = {}
+
+    def describe(self):
+        if self.details is None:
+            filename = str(self.item)
+
+            # Find out who owns the file
+            info = self.item.stat()
+            uid = info[stat.ST_UID]
+            gid = info[stat.ST_GID]
+            self.details = dict(
+                filename=filename,
+                filename_relative=filename.replace(os.getcwd(), '.'),
+                uid=uid,
+                gid=gid,
+                username=username(uid),
+                group=groupname(gid),
+            )
+        return self.details
+
+    def checksum(self, algorithm):
+        '''
+        Hex and binary checksum of the item contents.
+        '''
+        if algorithm not in self.checksums:
+            hashing = checksum.new(algorithm)
+            # The probe may still be reading from the current handle
+            handle = getattr(self.item, 'handle', None)
+            self.item.open('rb')
+            try:
+                for chunk in iter(lambda: self.item.read(65536), b''):
+                    hashing.update(chunk)
+            finally:
+                self.item.close()
+                self.item.handle = handle
+            self.checksums[algorithm] = (hashing.hexdigest(), hashing.digest())
+        return self.checksums[algorithm]
+
+
+# Context of the item that was last reported on
+CONTEXT = None
+
+
+def get_context(item):
+    global CONTEXT
+    if CONTEXT is None or CONTEXT.item is not item:
+        CONTEXT = Context(item)
+    return CONTEXT
+
+
+class LineBuffer(object):
+    '''
+    Splits chunks of data into lines, keeping the trailing partial line until
+    the next chunk arrives. Like files opened in text mode, ``\\r\\n`` and
+    ``\\r`` line endings are translated to ``\\n``.
+
+    >>> lines = LineBuffer()
+    >>> lines.feed(b'a\\r\\nb\\r'), lines.feed(b'\\nc\\rd')
+    ([b'a\\n'], [b'b\\n', b'c\\n'])
+    >>> lines.flush()
+    [b'd']
+    '''
+
+    def __init__(self):
+        self.partial = []
+
+    def feed(self, chunk):
+        if b'\n' not in chunk and b'\r' not in chunk:
+            if chunk:
+                self.partial.append(chunk)
+            return []
+
+        if self.partial:
+            self.partial.append(chunk)
+            chunk = b''.join(self.partial)
+
+        # A trailing \r may be followed by \n in the next chunk
+        tail = b''
+        if chunk.endswith(b'\r'):
+            chunk, tail = chunk[:-1], b'\r'
+
+        lines = translate_newlines(chunk).split(b'\n')
+        last = lines.pop() + tail
+        self.partial = [last] if last else []
+        return [line + b'\n' for line in lines]
+
+    def flush(self):
+        data = b''.join(self.partial)
+        self.partial = []
+        lines = translate_newlines(data).split(b'\n')
+        last = lines.pop()
+        lines = [line + b'\n' for line in lines]
+        if last:
+            lines.append(last)
+        return lines
+
+
+def translate_newlines(data):
+    '''
+    Translate ``\\r\\n`` and ``\\r`` line endings to ``\\n``.
+
+    >>> translate_newlines(b'a\\r\\nb\\rc\\n')
+    b'a\\nb\\nc\\n'
+    '''
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data
+
+
+def feed_probes(item, probes, blocksize=65536, digest=None):
+    '''
+    Read the item once, feeding each chunk to all probes that still want more
+    data. Failing probes are logged and dropped, read errors are raised as
+    :class:`classified.meta.CorruptionError`. If a ``digest`` is given, the
+    item is read to the end and the digest is updated with its contents.
+    '''
+    def call(method, *args):
+        try:
+            return method(item, *args)
+        except Exception as error:
+            probe = method.__self__
+            logging.error('probe %s on %r failed: %s' % (probe.name, item,
+                error))
+            if probe in active:
+                active.remove(probe)
+            return None
+
+    active = list(probes)
+    for probe in probes:
+        call(probe.start)
+    if not active and digest is None:
+        return
+
+    # Read from our own handle, probes may (re)open the item themselves. The
+    # probes get a copy of each chunk, as they may keep data between chunks
+    item.open('rb')
+    handle = item.handle
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    try:
+        while active or digest is not None:
+            # Decompressing handles raise their own errors on corrupt data,
+            # such as zipfile.BadZipFile or lzma.LZMAError
+            try:
+                size = handle.readinto(buffer)
+            except Exception as error:
+                raise item.Corrupt('%s: %s' % (item.path, error))
+            if not size:
+                break
+
+            if digest is not None:
+                digest.update(view[:size])
+            if not active:
+                continue
+
+            chunk = bytes(view[:size])
+            for probe in active[:]:
+                if call(probe.feed, chunk) is False:
+                    active.remove(probe)
+                    call(probe.finish)
+
+        for probe in active[:]:
+            call(probe.finish)
+    finally:
+        view.release()
+        handle.close()
+
 
 def isdigit(x):
     if isinstance(x, str):
@@ -1,18 +1,70 @@
 # Parts are courtesey of `Ben Hogdson <http://benhodgson.com/>`_.
 
 # Python imports
+import itertools
 import logging
 import re
 
 # Project imports
-from classified.probe.base import Probe, isdigit
+from classified.probe.base import Probe, isdigit, translate_newlines
+from classified.probe.pan.iin import IINTable, DEFAULT
 
 
 decimal_decoder = lambda s: int(s, 10)
 decimal_encoder = lambda i: str(i)
 
+# Luhn values of the ASCII decimal digits, for use with bytes.translate
+LUHN_PLAIN = bytes(bytearray(
+    char - 48 if 48 <= char <= 57 else 0
+    for char in range(256)
+))
+LUHN_DOUBLE = bytes(bytearray(
+    sum(divmod(2 * (char - 48), 10)) if 48 <= char <= 57 else 0
+    for char in range(256)
+))
+
+
+def luhn_sum_decimal(digits):
+    '''
+    Calculates the Luhn sum of a bytes string of ASCII decimal digits.
+
+    >>> luhn_sum_decimal(b'5105105105105100')
+    0
+    '''
+    return (sum(digits.translate(LUHN_PLAIN)[::-2]) +
+        sum(digits.translate(LUHN_DOUBLE)[-2::-2])) % 10
+
+
+def luhn_prefix_sums(digits):
+    '''
+    Calculates the running Luhn sums of a bytes string of ASCII decimal
+    digits, so the Luhn sum of all windows can be looked up. For both
+    parities, the digits at the positions of that parity are doubled. The
+    Luhn sum of ``digits[start:stop]`` is:
+
+    >>> sums = luhn_prefix_sums(b'005105105105105100')
+    >>> start, stop = 2, 18
+    >>> (sums[stop % 2][stop] - sums[stop % 2][start]) % 10
+    0
+    '''
+    plain = digits.translate(LUHN_PLAIN)
+    doubled = digits.translate(LUHN_DOUBLE)
+    sums = []
+    for parity in (0, 1):
+        values = bytearray(plain)
+        values[parity::2] = doubled[parity::2]
+        sums.append(list(itertools.accumulate(b'\x00' + values)))
+    return sums
+
 
 def luhn_sum_mod_base(string, base=10, decoder=decimal_decoder):
+    # Fast path for decimal strings
+    if base == 10 and decoder is decimal_decoder and string.isdigit():
+        try:
+            return luhn_sum_decimal(string.encode('ascii'))
+        except UnicodeEncodeError:
+            pass
+
     # Adapted from http://en.wikipedia.org/wiki/Luhn_algorithm
     digits = list(map(decoder, string))
     return (sum(digits[::-2]) +
@@ -104,146 +156,182 @@ class PAN(Probe):
 
     target = ('text/*',)
     format = '{filename}[{line:d}]: {company} {card_number_masked}'
+    chunked = True
     ignore = list('\x00-:\r\n')
-    _check = {
-        'American Express': dict(
-            length = [15],
-            prefix = re.compile(r'^3[47]'),
-        ),
-        'Diners Club EnRoute': dict(
-            length = [15],
-            prefix = re.compile(r'^(?:2014|2149)'),
-        ),
-        'Diners Club Carte Blanche': dict(
-            length = [14],
-            prefix = re.compile(r'^30[1-5]'),
-        ),
-        'Diners Club International': dict(
-            length = [14],
-            prefix = re.compile(r'^36'),
-        ),
-        'Diners Club America': dict(
-            length = [14],
-            prefix = re.compile(r'^5[45]'),
-        ),
-        'Discover': dict(
-            length = [16],
-            prefix = re.compile(r'^6011'),
-        ),
-        'InstaPayment': dict(
-            length = [16],
-            prefix = re.compile(r'^63[7-9]'),
-        ),
-        'JCB': dict(
-            length = [16],
-            prefix = re.compile(r'^(?:3088|3096|3112|3158|3337|352[89]|35[3-7][0-9]|358[0-9])'),
-        ),
-        'Laser': dict(
-            length = list(range(12, 20)),
-            prefix = re.compile(r'^(?:6304|6706|6771|6709)'),
-        ),
-        'Maestro': dict(
-            length = list(range(12, 20)),
-            prefix = re.compile(r'^(?:5018|5020|5038|5893|6304|6759|676[1-3]|0604)'),
-        ),
-        'MasterCard': dict(
-            length = [16],
-            prefix = re.compile(r'^5[1-5]'),
-        ),
-        'VISA': dict(
-            length = [13, 16],
-            prefix = re.compile(r'^4'),
-        ),
-    }
 
     def __init__(self, config, *args, **kwargs):
         super(PAN, self).__init__(config, *args, **kwargs)
 
-        # Also keep track of per prefix size checks
-        self._check_size = {}
-        for company, checks in self._check.items():
-            for length in checks['length']:
-                if length not in self._check_size:
-                    self._check_size[length] = {}
-                self._check_size[length][company] = checks['prefix']
+        # Issuer identification numbers, per card number length
+        filename = self.config.getdefault('probe:pan', 'iin_ranges', None)
+        if filename:
+            self.iin = IINTable.load(filename)
+        else:
+            self.iin = IINTable.parse(DEFAULT)
 
         # Ignores, if configured
         if self.config.has_option('probe:pan', 'ignore'):
             self.ignore = [chr(int(char, 16)) for char in self.config.getlist('probe:pan', 'ignore')]
 
+        # Digit runs may contain single ignored characters, two successive
+        # ignored characters end the run
+        self.digits_min = min(self.iin.lengths)
+        self.digits_max = max(self.iin.lengths)
+        self.separators = bytes(bytearray(ord(char) for char in self.ignore))
+        if self.ignore:
+            run = b'[0-9](?:[' + re.escape(self.separators) + b']?[0-9])'
+        else:
+            run = b'[0-9](?:[0-9])'
+        self.run = re.compile(run + b'{%d,}' % (self.digits_min - 1,))
+        self.run_any = re.compile(run + b'*')
+        self.join_lines = b'\n' in self.separators
+
+        try:
+            self.limit = self.config.getint('probe:pan', 'limit')
+        except self.config.Error:
+            self.limit = 0
+
     def luhn_check(self, card_number):
         # Do the Luhn check
         if verify(card_number):
             return self.process_prefix(card_number)
 
     def process_prefix(self, card_number):
-        length = len(card_number)
-        if length in self._check_size:
-            for company, prefix in self._check_size[length].items():
-                if prefix.match(card_number):
-                    return company
-
-    def probe(self, item):
-        # Keep track of consecutive ranges of numbers, stripping out potential
-        # padding characters
-
-        digits = []
-        digits_min = min(self._check_size)
-        digits_max = max(self._check_size)
-
-        line = 0
-        hits = 0
-        try:
-            limit = self.config.getint('probe:pan', 'limit')
-        except self.config.Error:
-            limit = 0
-
-        prev = chr(0)
-        for text in item.open():
-            line += 1
-
-            for char in text:
-                # If we have a digit, append it to the digits list
-                if isdigit(char):
-                    digits.append(int(char))
-
-                    if len(digits) >= digits_max:
-                        digits = digits[1:]
-
-                    if len(digits) >= digits_min:
-                        for x in range(digits_min, digits_max + 1):
-                            card_number = ''.join(map(str, digits[:x]))
-                            card_company = self.luhn_check(card_number)
-                            if card_company is not None:
-                                self.record(item,
-                                    raw=text,
-                                    line=line,
-                                    card_number=card_number,
-                                    card_number_masked=mask(card_number),
-                                    company=card_company,
-                                )
-
-                                # Rotate digits
-                                digits = digits[x:]
-
-                                # Keep track of hits
-                                hits += 1
-                                if limit and hits >= limit:
-                                    logging.debug('pan probe hit limit '
-                                                  'of %d' % limit)
-                                    return
-                                break
-
-                # We ignore dashes, new lines and carriage returns
-                elif char in self.ignore:
-                    # .. if we have two successive ignored characters, reset
-                    # the digits array
-                    if prev in self.ignore:
-                        digits = []
-
-                # Otherwise we'll reset the buffer
-                else:
-                    digits = []
-
-                # Keep track of the previous character
-                prev = char
+        return self.iin.lookup(card_number)
+
+    def start(self, item):
+        # Trailing partial line, scanned once it is complete
+        self.buffer = b''
+        # Digits of a run that may continue in the next block
+        self.window = b''
+        self.line = 0
+        self.hits = 0
+
+    def feed(self, item, chunk):
+        data = self.buffer + chunk
+        # Lines end in \n, \r\n or \r, but a trailing \r may be followed by
+        # \n in the next chunk
+        end = max(data.rfind(b'\n'), data.rfind(b'\r', 0, -1)) + 1
+        if not end:
+            self.buffer = data
+            return
+
+        self.buffer = data[end:]
+        if self.scan(item, translate_newlines(data[:end])) is False:
+            self.buffer = None
+            return False
+
+    def finish(self, item):
+        if self.buffer:
+            self.scan(item, translate_newlines(self.buffer))
+
+    def scan(self, item, block):
+        '''
+        Scan a block of lines for digit runs, the runs are matched by the
+        compiled expressions and only their digits are checked.
+        '''
+        self.offset = 0
+        window, self.window = self.window, b''
+        end = 0
+
+        # The last run of the previous block continues on our first line
+        if window and block[:1].isdigit():
+            match = self.run_any.match(block)
+            window = self.scan_run(item, block, match, window)
+            if window is False:
+                return False
+            end = match.end()
+
+        for match in self.run.finditer(block, end):
+            window = self.scan_run(item, block, match, b'')
+            if window is False:
+                return False
+            end = match.end()
+
+        # A run ending on the last line continues if the next line starts
+        # with a digit
+        if self.join_lines and block.endswith(b'\n') \
+                and block[-2:-1].isdigit():
+            if end == len(block) - 1:
+                self.window = window
+            else:
+                # Too short for the run expression, so it was not scanned
+                tail = block[-2 * self.digits_min - 1:-1]
+                for match in self.run_any.finditer(tail):
+                    pass
+                self.window = match.group().translate(None, self.separators)
+
+        self.line += block.count(b'\n', self.offset)
+
+    def scan_run(self, item, block, match, window):
+        '''
+        Check the digits in a run, ``window`` holds the digits of the
+        previous block that are still in range. Returns the digits that are
+        still in range at the end of the run, or False if we reached the hit
+        limit.
+        '''
+        text = match.group()
+        digits = window + text.translate(None, self.separators)
+        digits_min = self.digits_min
+        digits_max = self.digits_max
+
+        # Digits in range are digits[start:end]
+        sums = luhn_prefix_sums(digits)
+        start = 0
+        for end in range(len(window) + 1, len(digits) + 1):
+            if end - start > digits_max:
+                # Window is full, drop the first digit and try all lengths
+                start += 1
+                sizes = range(digits_min, digits_max + 1)
+            elif end - start >= digits_min:
+                # Shorter lengths have been tried before
+                sizes = (end - start,)
+            else:
+                continue
+
+            for size in sizes:
+                stop = start + size
+                if (sums[stop % 2][stop] - sums[stop % 2][start]) % 10:
+                    continue
+
+                card_number = digits[start:stop].decode('ascii')
+                card_company = self.process_prefix(card_number)
+                if card_company is not None:
+                    index = end - 1 - len(window)
+                    if len(text) != len(digits) - len(window):
+                        index = [
+                            offset for offset, char in enumerate(text)
+                            if isdigit(char)
+                        ][index]
+
+                    line, raw = self.locate(block, match.start() + index)
+                    self.record(item,
+                        raw=raw,
+                        line=line,
+                        card_number=card_number,
+                        card_number_masked=mask(card_number),
+                        company=card_company,
+                    )
+
+                    # Rotate digits
+                    start += size
+
+                    # Keep track of hits
+                    self.hits += 1
+                    if self.limit and self.hits >= self.limit:
+                        logging.debug('pan probe hit limit '
+                                      'of %d' % self.limit)
+                        return False
+                    break
+
+        return digits[start:]
+
+    def locate(self, block, offset):
+        '''
+        Returns the line number and the line at offset in the block.
+        '''
+        self.line += block.count(b'\n', self.offset, offset)
+        self.offset = offset
+        head = block.rfind(b'\n', 0, offset) + 1
+        tail = block.find(b'\n', offset) + 1 or len(block)
+        return self.line + 1, block[head:tail]
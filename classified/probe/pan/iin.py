@@ -0,0 +1,149 @@
+'''
+Issuer identification number (IIN) tables, used to find the company that
+issued a card number.
+
+The tables are loaded from text files with one company per line, holding the
+company name, the card number lengths and the IIN prefixes, separated by
+semicolons. Lengths and prefixes are comma separated, and may contain ranges::
+
+    # company               lengths     prefixes
+    American Express      ; 15        ; 34, 37
+    Maestro               ; 12-19     ; 5018, 5020, 5038, 6761-6763
+
+If multiple prefixes match a card number, the longest prefix wins. Prefixes of
+the same length are won by the company that was listed first.
+'''
+
+# Python imports
+import logging
+
+
+DEFAULT = '''
+# company                   lengths     prefixes
+American Express          ; 15        ; 34, 37
+Diners Club EnRoute       ; 15        ; 2014, 2149
+Diners Club Carte Blanche ; 14        ; 301-305
+Diners Club International ; 14        ; 36
+Diners Club America       ; 14        ; 54, 55
+Discover                  ; 16        ; 6011
+InstaPayment              ; 16        ; 637-639
+JCB                       ; 16        ; 3088, 3096, 3112, 3158, 3337, 3528-3589
+Laser                     ; 12-19     ; 6304, 6706, 6771, 6709
+Maestro                   ; 12-19     ; 5018, 5020, 5038, 5893, 6304, 6759,
+                                        6761-6763, 0604
+MasterCard                ; 16        ; 51-55
+VISA                      ; 13, 16    ; 4
+'''
+
+
+class IINTable(object):
+    '''
+    Prefix trie of IINs, per card number length.
+    '''
+
+    def __init__(self):
+        self.tries = {}
+
+    def add(self, company, lengths, prefix):
+        for length in lengths:
+            node = self.tries.setdefault(length, {})
+            for digit in prefix:
+                node = node.setdefault(digit, {})
+            # First company listed wins
+            node.setdefault(None, company)
+
+    def lookup(self, card_number):
+        '''
+        Returns the company for the longest matching prefix, or None.
+
+        >>> table = IINTable.parse(DEFAULT)
+        >>> table.lookup('5105105105105100')
+        'MasterCard'
+        >>> table.lookup('6304000000000000')
+        'Laser'
+        '''
+        node = self.tries.get(len(card_number), {})
+        company = node.get(None)
+        for digit in card_number:
+            node = node.get(digit)
+            if node is None:
+                break
+            company = node.get(None, company)
+        return company
+
+    @property
+    def lengths(self):
+        return sorted(self.tries)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as handle:
+            return cls.parse(handle.read(), filename)
+
+    @classmethod
+    def parse(cls, text, filename='<default>'):
+        table = cls()
+        entries = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            line = line.split('#', 1)[0]
+            if not line.strip():
+                continue
+
+            # Continuation of the previous line
+            if line[0].isspace() and entries:
+                entries[-1][1] += ' ' + line.strip()
+                continue
+
+            entries.append([number, line.strip()])
+
+        for number, line in entries:
+            try:
+                company, lengths, prefixes = [
+                    part.strip() for part in line.split(';')
+                ]
+                lengths = [
+                    int(length, 10)
+                    for length in cls.expand(lengths)
+                ]
+                prefixes = cls.expand(prefixes)
+                if not company or not lengths or not prefixes:
+                    raise ValueError('empty field')
+                for prefix in prefixes:
+                    if not prefix.isdigit():
+                        raise ValueError('invalid prefix %r' % prefix)
+            except ValueError as error:
+                logging.error('%s[%d]: invalid IIN range: %s' % (
+                    filename, number, error))
+                raise
+
+            for prefix in prefixes:
+                table.add(company, lengths, prefix)
+
+        return table
+
+    @staticmethod
+    def expand(text):
+        '''
+        Expands a comma separated list of numbers and ranges of numbers, the
+        numbers in a range must have the same number of digits.
+
+        >>> IINTable.expand('34, 51-53')
+        ['34', '51', '52', '53']
+        '''
+        items = []
+        for part in text.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            elif '-' in part:
+                lower, upper = [bound.strip() for bound in part.split('-', 1)]
+                if len(lower) != len(upper):
+                    raise ValueError('range %s has bounds of unequal length' %
+                                     part)
+                items.extend([
+                    str(number).zfill(len(lower))
+                    for number in range(int(lower, 10), int(upper, 10) + 1)
+                ])
+            else:
+                items.append(part)
+        return items
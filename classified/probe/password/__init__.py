@@ -4,13 +4,14 @@ import re
 
 
 # Project imports
-from classified.probe.base import Probe
+from classified.probe.base import Probe, LineBuffer
 
 
 class Password(Probe):
     default_pattern = r'\bpass(?:|wd|word)\b[ \s\t=:]+(?P<password>.*)'
     target = ('text/*',)
     format = '{filename_relative}[{line}]: {type} {text_masked}'
+    chunked = True
 
     def __init__(self, config, *args, **kwargs):
         super(Password, self).__init__(config, *args, **kwargs)
@@ -23,51 +24,61 @@ class Password(Probe):
             pattern = pattern.decode('ascii')
         self.re_password = re.compile(pattern)
 
-    def probe(self, item):
-        filename = str(item)
-        basename = os.path.basename(filename)
+    def start(self, item):
+        self.lines = LineBuffer()
+        self.line = 0
+        self.pgpass = 'pgpass' in os.path.basename(str(item))
+        self.pending = []
 
-        item.open()
-        try:
-            if 'pgpass' in basename:
-                self.probe_pgpass(item)
+    def feed(self, item, chunk):
+        for text in self.lines.feed(chunk):
+            self.probe_line(item, text)
+
+    def finish(self, item):
+        for text in self.lines.flush():
+            self.probe_line(item, text)
+
+        # Heuristic findings in pgpass files are reported after the pgpass
+        # findings
+        for kwargs in self.pending:
+            self.record(item, **kwargs)
+        self.pending = []
+
+    def probe_line(self, item, text):
+        text = text.decode('utf-8', 'replace')
+        self.line += 1
 
-            # Scan for passwords heuristically in any case            
-            line = 0
-            for text in item:
-                if isinstance(text, bytes):
-                    text = text.decode('utf-8')
-                line += 1
-                for password in self.re_password.findall(text):
-                    if password == '':
-                        continue
+        if self.pgpass:
+            self.probe_pgpass(item, text)
 
-                    self.record(item,
-                        raw=text,
-                        type='password',
-                        line=line,
-                        text=text.rstrip(),
-                        text_masked=text.rstrip().replace(password, '********'),
-                        password=password,
-                        password_masked='********',
-                    )
-        finally:
-            item.close()
+        # Scan for passwords heuristically in any case
+        for password in self.re_password.findall(text):
+            if password == '':
+                continue
 
-    def probe_pgpass(self, item):
-        line = 0
-        for text in item:
-            line += 1
-            part = text.split(':')
-            if len(part) == 5 and part[4]:
-                self.record(item,
-                    raw=text,
-                    type='pgpass',
-                    line=line,
-                    text=text.rstrip(),
-                    text_masked=':'.join(part[:4] + ['********']),
-                    password=part[4],
-                    password_masked='********',
-                )
+            kwargs = dict(
+                raw=text,
+                type='password',
+                line=self.line,
+                text=text.rstrip(),
+                text_masked=text.rstrip().replace(password, '********'),
+                password=password,
+                password_masked='********',
+            )
+            if self.pgpass:
+                self.pending.append(kwargs)
+            else:
+                self.record(item, **kwargs)
 
-        item.seek(0)  # reset file handle
+    def probe_pgpass(self, item, text):
+        part = text.split(':')
+        if len(part) == 5 and part[4]:
+            self.record(item,
+                raw=text,
+                type='pgpass',
+                line=self.line,
+                text=text.rstrip(),
+                text_masked=':'.join(part[:4] + ['********']),
+                password=part[4],
+                password_masked='********',
+            )
@@ -9,6 +9,7 @@ class PCAP(Probe):
     magic = 0xa1b2c3d4
     target = ('application/octet-stream', 'application/vnd.tcpdump.pcap')
     format = '{filename_relative}[{line:d}]: pcap v{version} ({linktype})'
+    chunked = True
     header = 'IHHiIII'
     header_size = struct.calcsize(header)
     linktype = {
@@ -85,14 +86,16 @@ class PCAP(Probe):
         248: 'SCTP',
     }
 
-    def probe(self, item):
-        item.open('rb')
-        chunk = item.read(self.header_size)
-        if len(chunk) != self.header_size:
-            return
+    def start(self, item):
+        self.data = b''
+
+    def feed(self, item, chunk):
+        self.data += chunk[:self.header_size - len(self.data)]
+        if len(self.data) < self.header_size:
+            return True
 
         magic, version_major, version_minor, thiszone, \
-            sigfigs, snaplen, network = struct.unpack(self.header, chunk)
+            sigfigs, snaplen, network = struct.unpack(self.header, self.data)
 
         if magic == self.magic:
             self.record(item,
@@ -102,3 +105,6 @@ class PCAP(Probe):
                 version_minor=version_minor,
                 linktype=self.linktype.get(network, 'Unknown'),
             )
+
+        # We only need the header
+        return False
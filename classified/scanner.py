@@ -1,16 +1,30 @@
 # Python imports
+import collections
 import fnmatch
 import logging
+import multiprocessing
+import multiprocessing.util
 import os
+import pwd
 import re
 import datetime
+import time
 import traceback
 import io
 
 # Project imports
-from classified.incremental import Incremental
-from classified.meta import Path, File, CorruptionError
+from classified import checksum
+from classified.checksum import tee
+from classified.dedupe import Dedupe
+from classified.incremental import (get_incremental,
+                                    get_incremental_backend, below)
+from classified.meta import Path, File, Archive, ArchiveFile, CorruptionError
+from classified.platform import get_mount_table
+from classified.mimecache import MimetypeCache
+from classified.packages import Packages
+from classified.pathindex import PathIndex
 from classified.probe import get_probe
+from classified.probe.base import feed_probes
 from classified.report import get_report
 import classified.report.all
 
@@ -21,23 +35,123 @@ except ImportError:
     markdown = None
 
 
+# Scanner instance of a worker process
+WORKER = None
+
+
+def _worker_init(config, option, packages=None):
+    global WORKER
+
+    # The incremental cache is maintained by the main process, unless it can
+    # be shared by the workers
+    if config.has_section('scanner') and \
+            not get_incremental_backend(config).shared:
+        config.set('scanner', 'incremental', 'no')
+
+    WORKER = Scanner(config, option, report=Recorder())
+
+    # The package index is built once by the main process
+    if WORKER.packages and packages is not None:
+        WORKER.packages.files = packages
+    multiprocessing.util.Finalize(None, WORKER.close, exitpriority=10)
+
+
+def _worker_scan(unit):
+    return WORKER.scan_unit(*unit)
+
+
+class Recorder(object):
+    '''
+    Collects the findings of the probes in a worker process, so they can be
+    sent to the report of the main process.
+    '''
+
+    def __init__(self):
+        self.findings = []
+
+    def report(self, probe, item, **kwargs):
+        self.findings.append((probe.name, str(item), kwargs))
+
+    def flush(self):
+        findings, self.findings = self.findings, []
+        return findings
+
+    # Alias
+    __call__ = report
+
+
+class Capture(object):
+    '''
+    Passes the findings of the probes on to a report, and keeps a copy of the
+    findings of the item being scanned for the incremental cache.
+    '''
+
+    def __init__(self, report):
+        self.target = report
+        self.findings = []
+
+    def report(self, probe, item, **kwargs):
+        self.findings.append((probe.name, kwargs))
+        self.target.report(probe, item, **kwargs)
+
+    def flush(self):
+        findings, self.findings = self.findings, []
+        return findings
+
+    # Alias
+    __call__ = report
+
+
 class Scanner(object):
-    def __init__(self, config, option):
+    # Size of the chunks fed to the probes
+    blocksize = 65536
+    # Number of items sent to a worker process at once
+    chunksize = 16
+
+    def __init__(self, config, option, report=None):
         self.config = config
         self.option = option
         self.started = datetime.datetime.now()
 
-        # Excluded file system types
-        self.exclude_dirs = []
+        # Number of scan processes
+        self.jobs = max(1, getattr(self.option, 'jobs', 1) or 1)
+
+        # Excluded directories, names match in any directory
+        self.exclude_dirs = PathIndex()
+        try:
+            self.exclude_dirs = PathIndex([
+                pattern if os.sep in pattern else '*' + os.sep + pattern
+                for pattern in self.config.getmulti('scanner', 'exclude_dirs')
+            ])
+        except self.config.Error:
+            pass
+
+        # Excluded file system types, looked up by device number
+        self.exclude_fs = None
         try:
-            self.exclude_dirs = self.config.getmulti('scanner', 'exclude_dirs')
+            self.exclude_fs = self.compile(
+                self.config.getmulti('scanner', 'exclude_fs'))
         except self.config.Error:
             pass
 
-        self.exclude_fs = []
+        # Size limit of scanned files
         try:
-            self.exclude_fs = self.config.getmulti('scanner', 'exclude_fs')
-            self.exclude_fs = [re.compile(fnmatch.translate(pattern)) for pattern in self.exclude_fs]
+            self.max_size = self.config.getint('scanner', 'max_size')
+        except self.config.Error:
+            self.max_size = 0
+
+        # Files owned by these users are excluded
+        self.exclude_user = set()
+        try:
+            for user in self.config.getmulti('scanner', 'exclude_user'):
+                if user.isdigit():
+                    self.exclude_user.add(int(user))
+                    continue
+                try:
+                    self.exclude_user.add(pwd.getpwnam(user).pw_uid)
+                except KeyError:
+                    logging.warning('%s: exclude_user %s does not exist' % (
+                        self.config.filename, user))
         except self.config.Error:
             pass
 
@@ -47,10 +161,10 @@ class Scanner(object):
         except self.config.Error:
             pass
 
-        self.exclude_type = []
+        self.exclude_type = None
         try:
-            self.exclude_type = self.config.getmulti('scanner', 'exclude_type')
-            self.exclude_type = [re.compile(fnmatch.translate(pattern)) for pattern in self.exclude_type]
+            self.exclude_type = self.compile(
+                self.config.getmulti('scanner', 'exclude_type'))
         except self.config.Error:
             pass
 
@@ -68,11 +182,11 @@ class Scanner(object):
                     raise
                 if repository_type not in self.exclude_repo:
                     self.exclude_repo[repository_type] = []
-                self.exclude_repo[repository_type].append(re.compile(
-                    fnmatch.translate(pattern)
-                ))
+                self.exclude_repo[repository_type].append(pattern)
         except self.config.Error:
             pass
+        for repository_type, patterns in self.exclude_repo.items():
+            self.exclude_repo[repository_type] = PathIndex(patterns)
 
         # Max traversal depths
         self.mindepth = int(self.config.getdefault('scanner', 'mindepth', -1))
@@ -92,15 +206,66 @@ class Scanner(object):
         # Incremental enabled?
         try:
             if self.config.getboolean('scanner', 'incremental'):
-                self.incremental = Incremental(self.config)
+                self.incremental = get_incremental(self.config)
             else:
                 self.incremental = False
         except self.config.Error:
             self.incremental = False
 
+        # Mime type detection, either strict (libmagic only) or fast
+        detection = self.config.getdefault('scanner', 'magic', 'strict')
+        if detection not in ('fast', 'strict'):
+            raise TypeError('Invalid magic mode %s, check the configuration' %
+                            detection)
+        File.mimetype_sniff = detection == 'fast'
+
+        # Mime type cache enabled? Incremental scans keep a cache next to the
+        # incremental database by default, so the mime types of unchanged
+        # files are looked up by their identity instead of being detected.
+        # The workers inherit the option
+        if self.incremental and \
+                self.config.getdefault('mimetype', 'database') is None:
+            if not self.config.has_section('mimetype'):
+                self.config.add_section('mimetype')
+            self.config.set('mimetype', 'database',
+                            self.incremental.database + '.mimetype')
+        if self.config.getdefault('mimetype', 'database'):
+            File.mimetype_cache = MimetypeCache(self.config)
+
         # Report enabled?
-        self.report = get_report(self.option.report_format, self.config,
-                                 self.option)
+        if report is None:
+            self.report = get_report(self.option.report_format, self.config,
+                                     self.option)
+        else:
+            self.report = report
+
+        # Files with the same contents are probed once?
+        self.dedupe = None
+        try:
+            if self.config.getboolean('scanner', 'dedupe'):
+                self.dedupe = Dedupe(self.config)
+        except self.config.Error:
+            pass
+
+        # Files that have their packaged contents are not probed?
+        self.packages = None
+        try:
+            if self.config.getboolean('scanner', 'exclude_packaged'):
+                self.packages = Packages(self.config)
+        except self.config.Error:
+            pass
+
+        # Findings are kept for the incremental cache and the dedupe
+        self.capture = None
+        if self.incremental or self.dedupe:
+            self.capture = Capture(self.report)
+
+        # Archives being walked, they are added to the incremental cache once
+        # all their members are scanned
+        self.archives = []
+
+        # Inodes of the directories and linked files that were walked
+        self.visited = set()
 
         # Import probes
         probes = set(self.option.probes.split(','))
@@ -130,8 +295,9 @@ class Scanner(object):
                 raise TypeError('Invalid probe %s enabled: %s' % (probe,
                     str(e)))
 
-        # Setup probes
+        # Setup probes, instances are reused for all items
         self.probes = {}
+        self.probe_instances = {}
         if self.config.has_section('probe'):
             for option in self.config.options('probe'):
                 pattern = re.compile(fnmatch.translate(option))
@@ -139,17 +305,81 @@ class Scanner(object):
 
         else:
             for name in probes:
-                probe = get_probe(name, self.config, self.report)
+                probe = self.get_probe(name)
                 for option in probe.target:
                     pattern = re.compile(fnmatch.translate(option))
                     if pattern not in self.probes:
                         self.probes[pattern] = []
                     self.probes[pattern].append(name)
 
+        # Probes that may run, excluding names that are not probes
+        self.enabled = []
+        for names in self.probes.values():
+            for name in names:
+                try:
+                    probe = self.get_probe(name)
+                except NotImplementedError:
+                    continue
+                if probe not in self.enabled:
+                    self.enabled.append(probe)
+
+        # Filters that exclude items before they are probed, cheapest first:
+        # path rules, rules using the stat result, and finally the rules that
+        # need the contents of the file
+        self.filters = []
+        if self.enabled:
+            self.filters.append(('ignore_name', self.test_ignore_name,
+                                 lambda item: 'ignored by all probes'))
+        if self.exclude_fs is not None:
+            self.filters.append(('exclude_fs', self.test_exclude_fs,
+                                 lambda item: 'excluded %s filesystem' % (
+                                     self.fs_type(item),)))
+        if self.max_size:
+            self.filters.append(('max_size', self.test_max_size,
+                                 lambda item: 'larger than %d bytes' % (
+                                     self.max_size,)))
+        if self.exclude_user:
+            self.filters.append(('exclude_user', self.test_exclude_user,
+                                 lambda item: 'excluded owner %d' % (
+                                     item.stat().st_uid,)))
+        if self.exclude_repo:
+            self.filters.append(('exclude_repo', self.test_exclude_repo,
+                                 lambda item: 'excluded %s repository' % (
+                                     item.repository.type,)))
+        self.content_filters = []
+        self.content_filters.append(('mimetype', self.test_no_mimetype,
+                                     lambda item: 'no mimetype'))
+        if self.exclude_type is not None:
+            self.content_filters.append(('exclude_type',
+                                         self.test_exclude_mimetype,
+                                         lambda item: 'excluded %s mime '
+                                         'type' % (item.mimetype,)))
+
+        # Number of items checked and excluded, and the time spent, by filter
+        self.filter_stats = collections.defaultdict(lambda: [0, 0, 0.0])
+
+    @staticmethod
+    def compile(patterns):
+        '''
+        Combine a list of globs in a single regular expression.
+        '''
+        if not patterns:
+            return None
+        return re.compile('|'.join(
+            fnmatch.translate(pattern)
+            for pattern in patterns
+        ))
+
+    def get_probe(self, name):
+        if name not in self.probe_instances:
+            self.probe_instances[name] = get_probe(name, self.config,
+                                                   self.capture or self.report)
+        return self.probe_instances[name]
+
     def probe(self, item, name):
         logging.debug('probe %s on %r' % (name, item))
         try:
-            probe = get_probe(name, self.config, self.report)
+            probe = self.get_probe(name)
             if probe.can_probe(item):
                 probe.probe(item)
         except NotImplementedError:
@@ -158,84 +388,581 @@ class Scanner(object):
             logging.error('probe %s on %r failed: %s' % (name, item, error))
 
     def scan(self, path, max_depth=10):
-        if os.path.isdir(path):
+        if os.path.isdir(path) and self.jobs > 1:
+            self.scan_parallel(path, max_depth)
+
+        elif os.path.isdir(path):
             for item in Path(path).walk(
                     recurse=True,
                     max_depth=max_depth,
                     deflate=self.deflate,
                     deflate_limit=self.deflate_limit,
+                    exclude=self.test_exclude_dir,
+                    links=not self.exclude_link,
+                    visited=self.visited,
+                    select=self.select_file,
                 ):
-                if self.scan_item(item) is StopIteration:
+                # Archive members were not selected by the walker
+                selected = not isinstance(item, ArchiveFile)
+                if self.scan_item(item, selected=selected) is StopIteration:
                     break
 
         else:
             self.scan_item(File(path))
 
-    def scan_item(self, item):
+        self.close_archives()
+
+        # Forget files that have gone since the previous run
+        if self.incremental and self.incremental.auto_prune:
+            self.incremental.prune(Path(path).path)
+
+        if File.mimetype_cache is not None:
+            File.mimetype_cache.flush()
+
+    def close(self):
+        self.log_stats()
+
+        if self.incremental:
+            self.incremental.close()
+            self.incremental = False
+
+        if File.mimetype_cache is not None:
+            File.mimetype_cache.close()
+            File.mimetype_cache = None
+
+    def log_stats(self):
+        if self.dedupe:
+            self.dedupe.log_stats()
+        if self.packages:
+            self.packages.log_stats()
+
+        for name, test, reason in self.filters + self.content_filters:
+            if name in self.filter_stats:
+                checked, excluded, elapsed = self.filter_stats[name]
+                logging.debug('filter %s: %d checked, %d excluded in %.3fs' %
+                              (name, checked, excluded, elapsed))
+
+    def scan_parallel(self, path, max_depth=10):
+        '''
+        Walk the tree in this process, and run the classify and probe stages
+        in a pool of worker processes. Results are processed in walk order,
+        so the report does not depend on the number of workers.
+        '''
+        logging.info('scanning %s using %d processes' % (path, self.jobs))
+
+        # The workers open their own mime type cache, a database connection
+        # can not be shared with a forked process
+        if File.mimetype_cache is not None:
+            File.mimetype_cache.close()
+            File.mimetype_cache = None
+
+        # Shared incremental stores are maintained by the workers
+        incremental = self.incremental
+        if incremental and incremental.shared:
+            incremental = False
+
+        # Build the package index before the workers are started, forked
+        # workers share it with this process
+        packages = None
+        if self.packages:
+            if self.packages.files is None:
+                self.packages.load()
+            packages = self.packages.files
+
+        pool = multiprocessing.Pool(
+            self.jobs,
+            initializer=_worker_init,
+            initargs=(self.config, self.option, packages),
+        )
+        try:
+            pending = collections.deque()
+            units = self._scan_units(path, max_depth, pending, incremental)
+            for findings, success, fingerprints, digest in pool.imap(
+                    _worker_scan, units, self.chunksize):
+                item = self._replay_pending(pending)
+                for name, filename, kwargs in findings:
+                    self.report.report(self.get_probe(name),
+                                       File(filename, link=False), **kwargs)
+
+                if incremental and success:
+                    incremental.add(item, fingerprints, [
+                        (name, kwargs) for name, filename, kwargs in findings
+                    ], digest)
+
+            self._replay_pending(pending)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _scan_units(self, path, max_depth, pending, incremental):
+        # The probes that scanned an unchanged file depend on its mime type,
+        # which is looked up in our own cache. The pool runs this generator in
+        # a thread of its own, so the cache is opened here
+        if incremental and self.config.getdefault('mimetype', 'database'):
+            File.mimetype_cache = MimetypeCache(self.config)
+
+        # The workers calculate the checksums while they scan the files
+        algorithm = None
+        if incremental and incremental.algorithm != 'mtime':
+            algorithm = incremental.algorithm
+
+        # Archive detection requires the mime type, which is left to the
+        # workers, so we don't deflate while walking
+        try:
+            for item, level in Path(path).walk_levels(
+                    recurse=True,
+                    max_depth=max_depth,
+                    deflate=False,
+                    exclude=self.test_exclude_dir,
+                    links=not self.exclude_link,
+                    visited=self.visited,
+                    select=self.select_file,
+                ):
+                if not item.readable:
+                    continue
+
+                elif incremental and incremental.unchanged(item) and \
+                        not incremental.stale_probes(
+                            item, self.unit_fingerprints(item)):
+                    logging.debug('skipping %s: file in incremental cache' % (
+                        item,))
+                    # Replayed in walk order, between the results of the
+                    # workers
+                    pending.append((item, incremental.findings(item)))
+                    continue
+
+                pending.append((item, None))
+                yield item, level, max_depth, algorithm
+        finally:
+            if File.mimetype_cache is not None:
+                File.mimetype_cache.close()
+                File.mimetype_cache = None
+
+    def _replay_pending(self, pending):
+        '''
+        Replay the findings of skipped items at the head of the queue, returns
+        the first item that was sent to a worker.
+        '''
+        while pending:
+            item, findings = pending.popleft()
+            if findings is None:
+                return item
+            self.replay(findings)
+
+    def replay(self, findings):
+        '''
+        Report the findings stored in the incremental cache.
+        '''
+        for name, kwargs in findings:
+            self.report.report(self.get_probe(name),
+                               File(kwargs['filename'], link=False), **kwargs)
+
+    def scan_unit(self, item, level, max_depth, algorithm=None):
+        '''
+        Scan a file in a worker process, returns the findings, the scan status,
+        the fingerprints of the probes that scanned the file and the checksum
+        of the file if an ``algorithm`` is given.
+        '''
+        fingerprints = {}
+        digest = hexdigest = None
+        if algorithm is not None:
+            digest = checksum.new(algorithm)
+        try:
+            item = File.maybe(
+                item.path,
+                deflate_if_archive=self.deflate,
+                deflate_limit=self.deflate_limit,
+                stat=item.stat(),
+                link=False,
+            )
+            if isinstance(item, Archive) and item.walkable:
+                success = self.scan_item(item, selected=True)
+                fingerprints = self.fingerprints()
+                if digest is not None:
+                    hexdigest = self.archive_checksum(item, digest)
+            else:
+                success = self.scan_item(item, digest, selected=True)
+                fingerprints = self.unit_fingerprints(item)
+                if digest is not None:
+                    hexdigest = digest.hexdigest()
+
+            if item.walkable:
+                if max_depth and level >= max_depth:
+                    logging.warning('%s max recursion depth' % (item.path,))
+                else:
+                    success = True
+                    for sub, _ in item.walk_levels(
+                            depth=level + 1,
+                            max_depth=max_depth,
+                            deflate=self.deflate,
+                            deflate_limit=self.deflate_limit,
+                        ):
+                        if self.scan_item(sub) is False:
+                            success = False
+
+                    # Corrupt archives are not stored as complete
+                    if isinstance(item, Archive) and not item.complete:
+                        success = False
+
+            self.close_archives()
+
+        except (IOError, OSError) as error:
+            logging.error('%s error %s' % (item.path, str(error)))
+            success = False
+
+        return self.report.flush(), success, fingerprints, hexdigest
+
+    def unit_fingerprints(self, item):
+        '''
+        Fingerprints of the probes that scan a walked file, archives are
+        scanned by all probes.
+        '''
+        if item.mimetype is None:
+            return {}
+        elif self.deflate and item.mimetype in Archive.supported_mimetypes \
+                and not 0 < self.deflate_limit < item.size:
+            return self.fingerprints()
+        return self.fingerprints(self.probe_names(item))
+
+    def scan_item(self, item, digest=None, selected=False):
+        '''
+        Scan a single item, returns True if all probes finished. The
+        ``digest`` is updated with the contents of the item. Items that were
+        ``selected`` by :meth:`select_file` are not filtered again.
+        '''
         if item is None:
             return
 
+        if self.incremental:
+            self.close_archives(item)
+            if isinstance(item, Archive) and item.walkable:
+                return self.open_archive(item)
+
         # No readable file? Skip
         if not item.readable:
             logging.debug('skipping %s: no readable content' % item)
             return
 
-        # No mime type? Skip
-        elif item.mimetype is None:
-            logging.debug('skipping %s: no mimetype' % item)
-            return
-
-        # Mime type exclusions
-        elif self.test_exclude_mimetype(item):
-            logging.debug('skipping %s: excluded %s mime type' % (item,
-                item.mimetype))
-            return
-
-        # File system type exclusions
-        elif self.test_exclude_fs(item):
-            logging.info('skipping %s: excluded %s filesystem' % (item,
-                item.mount.fs['type']))
+        # Exclusions
+        if not selected and not self.select_file(item):
             return
 
-        # Repository exclusions
-        elif self.test_exclude_repo(item):
-            logging.debug('skipping %s: excluded %s repository' % (item,
-                item.repository.type))
-            return
-
-        elif self.incremental and item in self.incremental:
-            logging.debug('skipping %s: file in incremental cache' % item)
+        reason = self.filter(item, self.content_filters)
+        if reason is not None:
+            logging.debug('skipping %s: %s' % (item, reason))
+            # Corrupt members are not readable, so the archive is not stored
+            # in the incremental cache
+            if not item.readable:
+                self.collect([], False)
+                return False
             return
 
+        # Items without probes have nothing to record
+        names = self.probe_names(item)
+        if self.incremental and names:
+            fingerprints = self.fingerprints(names)
+            stale = self.incremental.stale(item, fingerprints)
+            fresh = [name for name in names if name not in stale]
+            findings = []
+            if fresh:
+                findings = self.incremental.findings(item, fresh)
+                self.replay(findings)
+            if not stale:
+                logging.debug('skipping %s: file in incremental cache' % item)
+                self.collect(findings)
+                return
+
+            names = [name for name in names if name in stale]
+            self.capture.flush()
+
+            digest = self.incremental.digest(item)
+
+        # Files with the same contents as a file we probed before, the
+        # findings are those of the probes that do not ignore this path
+        dedupe_key = dedupe_digest = duplicate = None
+        runnable = names
+        if self.dedupe and names:
+            runnable = [
+                name for name in names
+                if self.get_probe(name).can_probe(item)
+            ]
+            if runnable:
+                dedupe_key, dedupe_digest, duplicate = self.dedupe.lookup(item)
+
+        hashing = None
+        if duplicate is not None and duplicate.names.issuperset(runnable):
+            logging.debug('scanning %r: same contents as %s' % (item,
+                duplicate.path))
+            self.replay_duplicate(item, duplicate, runnable)
+            dedupe_digest = None
+            probes = []
+        elif names and self.packages and self.packages.verify(item):
+            logging.debug('skipping %s: verified by the package manager' % (
+                item,))
+            probes = []
         else:
-            logging.debug('scanning %r' % item)
+            if dedupe_key is not None and dedupe_digest is None and names:
+                hashing = self.dedupe.new()
 
-        success = True
+            logging.debug('scanning %r' % item)
+            probes = names
+
+        # The checksums of the contents are calculated while the probes read
+        # the item, without probes the item is only read for the checksums
+        success = self.probe_item(item, probes, tee(digest, hashing))
+        if hashing is not None:
+            dedupe_digest = hashing.digest()
+
+        if self.capture is not None:
+            captured = self.capture.flush()
+            if dedupe_digest is not None and success:
+                self.dedupe.add(dedupe_key, dedupe_digest, item, runnable,
+                                captured)
+
+        if self.incremental and names:
+            if success:
+                self.incremental.add(item, dict(
+                    (name, fingerprints[name])
+                    for name in names
+                ), captured, digest and digest.hexdigest())
+            self.collect(findings + captured, success)
+
+        return success
+
+    def replay_duplicate(self, item, duplicate, names):
+        '''
+        Report the findings in a file with the same contents for this item,
+        ``names`` are the probes that can probe this item.
+        '''
+        for name, kwargs in duplicate.findings:
+            if name in names:
+                probe = self.get_probe(name)
+                kwargs = dict(kwargs)
+                probe.describe(item, kwargs)
+                probe.report.report(probe, item, **kwargs)
+        return True
+
+    def fingerprints(self, names=None):
+        '''
+        Fingerprints of the named probes, or of all enabled probes.
+        '''
+        if names is None:
+            names = set()
+            for probes in self.probes.values():
+                names.update(probes)
+
+        fingerprints = {}
+        for name in names:
+            try:
+                fingerprints[name] = self.get_probe(name).fingerprint
+            except NotImplementedError:
+                pass
+        return fingerprints
+
+    def open_archive(self, item):
+        '''
+        Archives that did not change are not walked, the findings in their
+        members are replayed from the incremental cache instead.
+        '''
+        fingerprints = self.fingerprints()
+        if not self.incremental.stale(item, fingerprints):
+            logging.debug('skipping %s: archive in incremental cache' % item)
+            item.walkable = False
+            findings = self.incremental.findings(item)
+            self.replay(findings)
+            self.collect(findings)
+        else:
+            self.archives.append([item, fingerprints, [], True,
+                                  self.archive_checksum(item)])
+        return True
+
+    def archive_checksum(self, item, digest=None):
+        '''
+        Checksum of the archive file, the probes only read the members so the
+        archive file is read for it before it is walked.
+        '''
+        if digest is None and self.incremental:
+            digest = self.incremental.digest(item)
+        if digest is None:
+            return None
+
+        self.probe_item(File(item.path, stat=item.stat(), link=False), [],
+                        digest)
+        return digest.hexdigest()
+
+    def close_archives(self, item=None):
+        '''
+        Add the archives that do not contain the item to the incremental
+        cache, if all their members were scanned.
+        '''
+        while self.archives:
+            archive, fingerprints, findings, success, checksum = \
+                self.archives[-1]
+            # Compressed files have a single member with the same path
+            if item is not None and below(item.path, archive.path):
+                break
+
+            self.archives.pop()
+            # Corrupt archives are not stored as complete
+            if success and archive.complete:
+                self.incremental.add(archive, fingerprints, findings,
+                                     checksum)
+
+    def collect(self, findings, success=True):
+        # Findings in archive members are also stored with the archive
+        for archive in self.archives:
+            archive[2].extend(findings)
+            if success is False:
+                archive[3] = False
+
+    def probe_names(self, item):
+        '''
+        Names of the probes that match the item mime type.
+        '''
+        names = []
         for pattern, probes in self.probes.items():
             if pattern.match(item.mimetype):
-                for probe in probes:
-                    try:
-                        self.probe(item, probe)
-                    except CorruptionError as e:
-                        logging.error('probe %s on %s failed: %s' % (probe,
-                            item, e))
-                        success = False
-
-        if self.incremental and success:
-            self.incremental.add(item)
+                for name in probes:
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def probe_item(self, item, names, digest=None):
+        '''
+        Run the named probes. Probes that support chunk feeding share a single
+        read of the item, other probes read the item by themselves. The
+        ``digest`` is updated in the same read. Returns False if the item
+        could not be read.
+        '''
+        success = True
+        chunked = []
+        for name in names:
+            try:
+                probe = self.get_probe(name)
+                if not probe.chunked:
+                    self.probe(item, name)
+                elif probe.can_probe(item):
+                    logging.debug('probe %s on %r' % (name, item))
+                    chunked.append(probe)
+            except NotImplementedError:
+                logging.warning('could not start probe %s: not implemented'
+                                % name)
+            except CorruptionError as e:
+                logging.error('probe %s on %s failed: %s' % (name, item, e))
+                success = False
+            except Exception as error:
+                logging.error('probe %s on %r failed: %s' % (name, item,
+                    error))
+
+        if chunked or digest is not None:
+            try:
+                feed_probes(item, chunked, self.blocksize, digest)
+            except (CorruptionError, IOError, OSError) as e:
+                if chunked:
+                    logging.error('probe %s on %s failed: %s' % (
+                        ', '.join([probe.name for probe in chunked]), item, e))
+                else:
+                    logging.error('reading %s failed: %s' % (item, e))
+                success = False
+
+        return success
+
+    def filter(self, item, filters):
+        '''
+        Run the filters, returns the reason the item is excluded, or None.
+        '''
+        for name, test, reason in filters:
+            stats = self.filter_stats[name]
+            start = time.perf_counter()
+            excluded = test(item)
+            stats[0] += 1
+            stats[2] += time.perf_counter() - start
+            if excluded:
+                stats[1] += 1
+                return reason(item)
+
+        return None
+
+    def select_file(self, item):
+        '''
+        Run the filters that do not need the contents of the item, returns
+        False if it is excluded. The walker runs them before archive
+        detection, which needs the mime type.
+        '''
+        reason = self.filter(item, self.filters)
+        if reason is not None:
+            logging.debug('skipping %s: %s' % (item, reason))
+            return False
+        return True
+
+    def fs_type(self, item, info=None):
+        '''
+        File system type of the item, looked up by device.
+        '''
+        if info is None:
+            info = item.stat()
+            # Archive members have no device, use the device of the archive
+            while info.st_dev <= 0 and getattr(item, 'archive', None):
+                item = item.archive
+                info = item.stat()
+
+        return get_mount_table().lookup(str(item), info.st_dev)['type']
+
+    def test_exclude_dir(self, path, entry=None):
+        '''
+        Test if the directory is excluded, if it is on an excluded file system
+        or if all probes ignore the files below it.
+        '''
+        if self.exclude_dirs.match(path):
+            return True
+
+        if self.exclude_fs is not None and entry is not None:
+            fs_type = self.fs_type(path, entry.stat())
+            if self.exclude_fs.match(fs_type):
+                logging.info('skipping %s: excluded %s filesystem' % (path,
+                    fs_type))
+                return True
+
+        return bool(self.enabled) and all(
+            probe.ignore_tree(path)
+            for probe in self.enabled
+        )
+
+    def test_ignore_name(self, item):
+        return bool(self.enabled) and all(
+            probe.ignore_name(item)
+            for probe in self.enabled
+        )
 
     def test_exclude_fs(self, item):
-        return item.mount.fs['type'] in self.exclude_fs
+        return self.exclude_fs.match(self.fs_type(item)) is not None
+
+    def test_max_size(self, item):
+        return item.size > self.max_size
+
+    def test_exclude_user(self, item):
+        return item.stat().st_uid in self.exclude_user
+
+    def test_no_mimetype(self, item):
+        return item.mimetype is None
 
     def test_exclude_mimetype(self, item):
-        return item.mimetype in self.exclude_type
+        return self.exclude_type.match(item.mimetype) is not None
 
     def test_exclude_repo(self, item):
-        if item.repository.type is not None:
-            for repository_type in (item.repository.type, 'any'):
-                if repository_type in self.exclude_repo:
-                    for pattern in self.exclude_repo[repository_type]:
-                        if pattern.match(str(item)):
-                            return True
-
-        return False
+        # Match the path first, finding the repository takes a lot of stats
+        path = str(item)
+        types = [
+            repository_type
+            for repository_type, index in self.exclude_repo.items()
+            if index.match(path)
+        ]
+        if not types:
+            return False
+
+        repository_type = item.repository.type
+        return repository_type is not None and (
+            repository_type in types or 'any' in types)
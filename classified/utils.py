@@ -1,5 +1,8 @@
 from collections import defaultdict
+from functools import lru_cache
 from itertools import chain
+import grp
+import pwd
 
 
 def flatten(iterable):
@@ -12,3 +15,19 @@ def leaders(iterable, top=10):
         counters[item] += 1
 
     return sorted(list(counters.items()), reverse=True, key=lambda tup: tup[1])[:top]
+
+
+@lru_cache(maxsize=4096)
+def username(uid):
+    try:
+        return pwd.getpwuid(uid)[0]
+    except KeyError:
+        return str(uid)
+
+
+@lru_cache(maxsize=4096)
+def groupname(gid):
+    try:
+        return grp.getgrgid(gid)[0]
+    except KeyError:
+        return str(gid)
@@ -22,7 +22,10 @@ setup(
         'classified': ['template/*/*'],
     },
     data_files   = [
-        ('/etc/classified', ['etc/classified.conf.example']),
+        ('/etc/classified', [
+            'etc/classified.conf.example',
+            'etc/iin_ranges.example',
+        ]),
     ],
     scripts      = ['bin/classified'],
 )
@@ -0,0 +1,155 @@
+'''
+Regression tests of the scanner, run them with ``make test``.
+'''
+
+# Python imports
+import logging
+import optparse
+import os
+import shutil
+import tempfile
+import unittest
+
+# Project imports
+from classified.config import Config
+from classified.incremental import get_incremental
+from classified.probe import IGNORE
+from classified.scanner import Scanner, Recorder
+
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'testdata')
+
+CONFIG = '''
+[scanner]
+deflate = yes
+deflate_limit = 104857600
+include_probe = ssl
+
+[probe]
+text/* = ssl
+'''
+
+
+class ScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        # Corrupt files are logged as errors
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+        # The probes keep their ignores for the process, read ours
+        IGNORE.clear()
+        self.addCleanup(IGNORE.clear)
+
+    def copy(self, name, target, mode=0o600):
+        path = os.path.join(self.root, target)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.copyfile(os.path.join(TESTDATA, name), path)
+        os.chmod(path, mode)
+        return path
+
+    def config(self, text=''):
+        config = Config('')
+        config.read_string(CONFIG)
+        config.read_string(text)
+        return config
+
+    def scan(self, config, jobs=1):
+        '''
+        Scan our files, returns the findings as (probe name, path, key info).
+        '''
+        option = optparse.Values(dict(probes='ssl', jobs=jobs))
+        scanner = Scanner(config, option, report=Recorder())
+        try:
+            scanner.scan(os.path.join(self.root, 'scan'))
+        finally:
+            scanner.close()
+        return sorted(
+            (name, filename, kwargs.get('key_info'))
+            for name, filename, kwargs in scanner.report.flush()
+        )
+
+
+class CorruptArchiveTest(ScannerTestCase):
+    '''
+    Archives that could not be walked completely are not stored in the
+    incremental cache, so they are walked (and reported) again.
+    '''
+
+    def check(self, backend, jobs):
+        archive = self.copy(os.path.join('archive', 'corrupt-key-archive.tar'),
+                            os.path.join('scan', 'corrupt.tar'))
+        config = self.config('''
+[scanner]
+incremental = yes
+
+[incremental]
+backend = %s
+database = %s
+''' % (backend, os.path.join(self.root, 'incremental')))
+
+        first = self.scan(config, jobs)
+        incremental = get_incremental(config)
+        try:
+            self.assertNotIn(archive, incremental.keys())
+        finally:
+            incremental.close()
+        self.assertEqual(self.scan(config, jobs), first)
+
+    def test_dbm(self):
+        self.check('dbm', 1)
+
+    def test_dbm_jobs(self):
+        self.check('dbm', 2)
+
+    def test_sqlite(self):
+        self.check('sqlite', 1)
+
+    def test_sqlite_jobs(self):
+        self.check('sqlite', 2)
+
+
+class DedupeTest(ScannerTestCase):
+    '''
+    Files with the same contents only share the findings of the probes that
+    do not ignore their path.
+    '''
+
+    def check(self, ignored, reported):
+        for name in (ignored, reported):
+            self.copy('key-rsa', os.path.join('scan', name, 'key'))
+        config = self.config('''
+[scanner]
+dedupe = yes
+include_probe = ssl, password
+
+[probe]
+text/* = ssl, password
+
+[probe:password]
+pattern = \\bpassword\\s*=\\s*(?P<password>\\S+)
+
+[clean:ssl]
+ignore_name = %s
+''' % (os.path.join(self.root, 'scan', ignored, '*'),))
+
+        found = self.scan(config)
+        self.assertEqual(
+            [filename for name, filename, key_info in found],
+            [os.path.join(self.root, 'scan', reported, 'key')],
+        )
+
+    # The walk order is not defined, one of both is walked first
+    def test_ignored_first(self):
+        self.check('a', 'b')
+
+    def test_ignored_last(self):
+        self.check('b', 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()